@@ -0,0 +1,104 @@
+# on-disk cache of pipeline artifacts (DataFrames stored as Parquet), keyed by a hash
+# of everything that produced them: the content of the input files, the parameters,
+# the source code behind the stages and the keys of upstream stages. A stage
+# whose key is already cached is skipped. The directory is kept under a size cap by
+# evicting the least recently used artifacts; a cache hit refreshes an artifact's mtime.
+
+import os
+import json
+import hashlib
+import inspect
+import pandas as pd
+
+DIGESTS = 'digests.json'  # file content hashes, reused while size and mtime are unchanged
+
+
+# hash of the source code of the given functions or whole modules
+def code_version(*objects):
+    digest = hashlib.sha256()
+    for obj in objects:
+        digest.update(inspect.getsource(obj).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class ArtifactCache:
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.digests_path = os.path.join(directory, DIGESTS)
+        try:
+            with open(self.digests_path) as f:
+                self.digests = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self.digests = {}
+
+    # sha256 of a file's content, rehashed only when its size or mtime changes
+    def file_digest(self, fname):
+        path = os.path.abspath(fname)
+        stat = os.stat(path)
+        known = self.digests.get(path)
+        if known and known[0] == stat.st_size and known[1] == stat.st_mtime_ns:
+            return known[2]
+
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        self.digests[path] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+        with open(self.digests_path, 'w') as f:
+            json.dump(self.digests, f)
+        return digest.hexdigest()
+
+    # key for a stage from strings (parameters, code versions, digests, upstream keys)
+    @staticmethod
+    def key(stage, *parts):
+        digest = hashlib.sha256(stage.encode('utf-8'))
+        for part in parts:
+            digest.update(b'\0' + str(part).encode('utf-8'))
+        return f'{stage}-{digest.hexdigest()[:32]}'
+
+    def path(self, key, name):
+        return os.path.join(self.directory, f'{key}-{name}.parquet')
+
+    # the named frames stored under key, or None unless all of them are there
+    def load(self, key, names):
+        paths = [self.path(key, name) for name in names]
+        if not all(os.path.exists(path) for path in paths):
+            return None
+        frames = [pd.read_parquet(path) for path in paths]
+        for path in paths:
+            os.utime(path)
+        return frames
+
+    def save(self, key, names, frames):
+        for name, frame in zip(names, frames):
+            frame.to_parquet(self.path(key, name))
+        self.evict(keep=key)
+
+    # delete least recently used artifacts until the cache fits in max_bytes,
+    # never the ones of the key just written
+    def evict(self, keep=None):
+        artifacts = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.parquet'):
+                stat = entry.stat()
+                artifacts.append((stat.st_mtime, stat.st_size, entry.path, entry.name))
+        total = sum(size for mtime, size, path, name in artifacts)
+        for mtime, size, path, name in sorted(artifacts):
+            if total <= self.max_bytes:
+                break
+            if keep is not None and name.startswith(keep + '-'):
+                continue
+            os.remove(path)
+            total -= size
+
+    # the frames of a stage: loaded when cached, otherwise computed and saved
+    def stage(self, key, names, compute):
+        frames = self.load(key, names)
+        if frames is None:
+            frames = compute()
+            self.save(key, names, frames)
+        else:
+            print(f'Using cached {key}')
+        return frames
@@ -0,0 +1,93 @@
+# this program compares the original "County Name, State" string join against the
+# categorical FIPS join in main.py and checks that they produce the same rows.
+# Reading the csv files is not timed
+# run it with -h to see the command line options
+
+import time
+import argparse
+from us_state_abbrev import abbrev_to_us_state
+from main import Dates, add_per_capita, clean_frames, join_on_fips, read_frames
+
+
+# original path, kept here as the baseline: strip, map states per row, string keys
+def string_join(cases_df, deaths_df, census_df, date):
+    cases_df = cases_df[['County Name', 'State', date]].copy()
+    deaths_df = deaths_df[['County Name', 'State', date]].copy()
+    census_df = census_df[['County', 'State', 'TotalPop', 'IncomePerCap', 'Poverty', 'Unemployment']].copy()
+
+    cases_df['County Name'] = cases_df['County Name'].str.strip()
+    deaths_df['County Name'] = deaths_df['County Name'].str.strip()
+    cases_df = cases_df[cases_df['County Name'] != 'Statewide Unallocated']
+    deaths_df = deaths_df[deaths_df['County Name'] != 'Statewide Unallocated']
+    cases_df['State'] = cases_df['State'].map(abbrev_to_us_state)
+    deaths_df['State'] = deaths_df['State'].map(abbrev_to_us_state)
+
+    cases_df['key'] = cases_df['County Name'] + ', ' + cases_df['State']
+    deaths_df['key'] = deaths_df['County Name'] + ', ' + deaths_df['State']
+    census_df['key'] = census_df['County'] + ', ' + census_df['State']
+    cases_df = cases_df.set_index('key')
+    deaths_df = deaths_df.set_index('key')
+    census_df = census_df.set_index('key')
+
+    cases_df.rename(columns={date: 'Cases'}, inplace=True)
+    deaths_df.rename(columns={date: 'Deaths'}, inplace=True)
+    join_df = cases_df.join(deaths_df[['Deaths']], how='inner')
+    census_df = census_df.drop(columns=['State'])
+    return add_per_capita(join_df.join(census_df, how='inner'))
+
+
+def fips_join(cases_df, deaths_df, census_df, date):
+    return add_per_capita(join_on_fips(*clean_frames(cases_df, deaths_df, census_df), date))
+
+
+def timed(func, frames, date, repeats):
+    best = None
+    for i in range(repeats):
+        start = time.perf_counter()
+        result = func(*frames, date)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+# compare the two joins on the "County Name, State" key: rows only one join found,
+# and whether the shared rows hold the same values
+def compare(slow, fast):
+    fast = fast.reset_index(drop=True)
+    fast.index = (fast['County Name'].astype(object) + ', ' + fast['State'].astype(object)).rename('key')
+    fast = fast.astype({'County Name': object, 'State': object, 'County': object})
+    slow = slow.astype({'County Name': object, 'State': object, 'County': object})
+
+    shared = slow.index.intersection(fast.index)
+    only_slow = slow.index.difference(fast.index)
+    only_fast = fast.index.difference(slow.index)
+    same = slow.loc[shared].sort_index().equals(fast.loc[shared, slow.columns].sort_index())
+    return same, list(only_slow), list(only_fast)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", "--date", default=Dates[0])
+    parser.add_argument("-r", "--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    frames = read_frames(args.date, categorical=False)
+    print(f"Joining {len(frames[0])} case rows, {len(frames[1])} death rows "
+          f"and {len(frames[2])} census rows, best of {args.repeats}")
+
+    slow, slow_elapsed = timed(string_join, frames, args.date, args.repeats)
+    fast, fast_elapsed = timed(fips_join, read_frames(args.date), args.date, args.repeats)
+    same, only_slow, only_fast = compare(slow, fast)
+
+    print(f"string key: {slow_elapsed:0.4f} seconds, {slow.memory_usage(deep=True).sum():,} bytes")
+    print(f"fips:       {fast_elapsed:0.4f} seconds, {fast.memory_usage(deep=True).sum():,} bytes")
+    print(f"speedup:    {slow_elapsed / fast_elapsed:0.1f}x")
+    print(f"{len(slow)} rows vs {len(fast)} rows, shared rows identical: {same}")
+    if only_slow:
+        print(f"only in the string join: {only_slow}")
+    if only_fast:
+        print(f"only in the fips join (names differ between files): {only_fast}")
+
+
+if __name__ == "__main__":
+    main()
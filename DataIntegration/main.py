@@ -1,86 +1,295 @@
+import os
+import sys
+import argparse
+import numpy as np
 import pandas as pd
+import us_state_abbrev
+import usafacts
 from us_state_abbrev import abbrev_to_us_state
-import seaborn as sns
-import matplotlib.pyplot as plt
+from usafacts import long_to_wide, read_dates, read_long, read_long_parquet, read_wide, write_long
+from rolling_corr import RollingCorrelation
+from artifact_cache import ArtifactCache, code_version
+from report import ReportWriter
 
-# Create dataframes from csv files
-cases_df = pd.read_csv('covid_confirmed_usafacts.csv')
-deaths_df = pd.read_csv('covid_deaths_usafacts.csv')
-census_df = pd.read_csv('acs2017_county_data.csv')
+CasesFile = 'covid_confirmed_usafacts.csv'
+DeathsFile = 'covid_deaths_usafacts.csv'
+CensusFile = 'acs2017_county_data.csv'
+Dates = ['2023-07-23']
+Start = None  # with Start/End, analyze every date in the range
+End = None
+ParquetFile = None  # long (countyFIPS, date, Cases, Deaths) table, built on first use
+OutputFile = None  # per-date correlation table as csv
+Window = None  # dates per rolling window, 0 for an expanding window
+CacheDir = None  # keep stage artifacts here and skip stages whose inputs are unchanged
+CacheMB = 1024  # size cap of CacheDir, least recently used artifacts are evicted
+ReportDir = None  # write tables and charts here instead of showing a plot window
 
-# Trim dataframes
-cases_df = cases_df[['County Name', 'State', '2023-07-23']]
-deaths_df = deaths_df[['County Name', 'State', '2023-07-23']]
-census_df = census_df[['County', 'State', 'TotalPop', 'IncomePerCap', 'Poverty', 'Unemployment']]
+CENSUS_COLUMNS = ['TotalPop', 'IncomePerCap', 'Poverty', 'Unemployment']
+METRICS = ['CasesPerCap', 'DeathsPerCap']
+COVARIATES = ['IncomePerCap', 'Poverty', 'Unemployment']
+# correlations tracked per date: each metric against the covariates and each other
+PAIRS = [(metric, other) for i, metric in enumerate(METRICS)
+         for other in METRICS[i + 1:] + COVARIATES]
 
-print(f'cases_df columns: {cases_df.columns}')
-print(f'deaths_df columns: {deaths_df.columns}')
-print(f'census_df columns: {census_df.columns}')
 
-cases_df['County Name'] = cases_df['County Name'].str.strip()
-deaths_df['County Name'] = deaths_df['County Name'].str.strip()
+# Create dataframes from csv files, reading only the columns we use. With categorical,
+# State and county names are parsed straight into categoricals
+def read_frames(date, categorical=True):
+    cases_df = read_dates(CasesFile, [date], categorical)
+    deaths_df = read_dates(DeathsFile, [date], categorical)
+    census_df = read_census(categorical)
+    return cases_df, deaths_df, census_df
 
-# Count 'Washington County' appearences
-cases_count = (cases_df['County Name'] == 'Washington County').sum()
-deaths_count = (deaths_df['County Name'] == 'Washington County').sum()
 
-print(f"'Washington County' in cases_df: {cases_count}")
-print(f"'Washington County' in deaths_df: {deaths_count}")
+def read_census(categorical=True):
+    census_dtype = {'County': 'category', 'State': 'category'} if categorical else None
+    census_columns = ['CountyId', 'County', 'State'] + CENSUS_COLUMNS
+    return pd.read_csv(CensusFile, usecols=census_columns, dtype=census_dtype)[census_columns]
 
-cases_df = cases_df[cases_df['County Name'] != 'Statewide Unallocated']
-deaths_df = deaths_df[deaths_df['County Name'] != 'Statewide Unallocated']
 
-print(f'Number of rows in cases_df: {len(cases_df)}')
-print(f'Number of rows in deaths_df: {len(deaths_df)}')
+# strip county names, drop the unallocated rows and convert state abbreviations to
+# full names. On the categoricals from read_frames the names are stripped and the
+# abbreviation dict is looked up once per category instead of once per row
+def clean_frames(cases_df, deaths_df, census_df):
+    cleaned = []
+    for df in (cases_df, deaths_df):
+        names = df['County Name'].astype('category')
+        stripped = names.cat.categories.str.strip()
+        if stripped.is_unique:
+            names = names.cat.rename_categories(stripped)
+        else:
+            names = names.str.strip().astype('category')
+        df = df.assign(**{'County Name': names,
+                          'State': df['State'].astype('category').map(abbrev_to_us_state)})
+        cleaned.append(df[df['County Name'] != 'Statewide Unallocated'])
+    census_df = census_df.assign(County=census_df['County'].astype('category'),
+                                 State=census_df['State'].astype('category'))
+    return cleaned[0], cleaned[1], census_df
 
-# Convert State abbreviations to full names
-cases_df['State'] = cases_df['State'].map(abbrev_to_us_state)
-deaths_df['State'] = deaths_df['State'].map(abbrev_to_us_state)
 
-print(cases_df.head())
+# join on the integer county FIPS code (countyFIPS, CountyId in the census file):
+# the three frames are indexed by it, sorted, and joined in a single pass
+def join_on_fips(cases_df, deaths_df, census_df, date):
+    cases_df = cases_df.set_index('countyFIPS').rename(columns={date: 'Cases'}).sort_index()
+    deaths_df = deaths_df.set_index('countyFIPS')[[date]].rename(columns={date: 'Deaths'}).sort_index()
+    census_df = census_df.drop(columns=['State']).set_index('CountyId').sort_index()
+    join_df = pd.concat([cases_df, deaths_df, census_df], axis=1, join='inner')
+    join_df.index.name = 'countyFIPS'
+    return join_df
 
-# Create key columns in each DataFrame by combining County and State
-cases_df['key'] = cases_df['County Name'] + ', ' + cases_df['State']
-deaths_df['key'] = deaths_df['County Name'] + ', ' + deaths_df['State']
-census_df['key'] = census_df['County'] + ', ' + census_df['State']
 
-# Set 'key' as the index in each DataFrame
-cases_df = cases_df.set_index('key')
-deaths_df = deaths_df.set_index('key')
-census_df = census_df.set_index('key')
+# Add per capita metrics
+def add_per_capita(join_df):
+    join_df['CasesPerCap'] = join_df['Cases'] / join_df['TotalPop']
+    join_df['DeathsPerCap'] = join_df['Deaths'] / join_df['TotalPop']
+    return join_df
 
-print(f'census_df after setting key to index:\n {census_df.head()}')
 
-# Rename columns
-cases_df.rename(columns={'2023-07-23': 'Cases'}, inplace=True)
-deaths_df.rename(columns={'2023-07-23': 'Deaths'}, inplace=True)
+# long (countyFIPS, date, Cases, Deaths) rows for Start..End, from ParquetFile when it
+# exists, otherwise melted from the csv files (and saved to ParquetFile if given)
+def read_range():
+    if ParquetFile and os.path.exists(ParquetFile):
+        return read_long_parquet(ParquetFile, Start, End)
+    if ParquetFile:
+        # keep every date so later runs can pick any range from the file
+        long_df = read_long(CasesFile, DeathsFile)
+        write_long(long_df, ParquetFile)
+        print(f'Wrote {len(long_df)} rows to {ParquetFile}')
+        return read_long_parquet(ParquetFile, Start, End)
+    return read_long(CasesFile, DeathsFile, Start, End)
 
-# Show updated column headers
-print("cases_df columns:", cases_df.columns.values.tolist())
-print("deaths_df columns:", deaths_df.columns.values.tolist())
 
-# Join cases_df and deaths_df
-join_df = cases_df.join(deaths_df[['Deaths']], how='inner')
+# per-capita metrics for every (county, date) and, in one groupby over the dates,
+# their correlations: a row per date and a column per PAIRS entry
+def correlate_by_date(long_df, census_df):
+    census = census_df.set_index('CountyId')[CENSUS_COLUMNS]
+    df = add_per_capita(long_df.join(census, on='countyFIPS', how='inner'))
+    matrices = df.groupby('date')[METRICS + COVARIATES].corr()
+    matrices.index.names = ['date', 'x']
+    stacked = matrices.stack()
+    return pd.DataFrame({f'{x}~{y}': stacked.xs((x, y), level=[1, 2]) for x, y in PAIRS})
 
-# Drop the duplicate state column
-census_df = census_df.drop(columns=['State'])
 
-# Join the result with census_df
-join_df = join_df.join(census_df, how='inner')
+# correlations over a window of dates ending at each date, pooling every
+# (county, date) in the window. The window is updated incrementally, one date
+# column at a time; window 1 gives the same table as correlate_by_date
+def correlate_rolling(cases, deaths, census_df, window):
+    census = census_df.set_index('CountyId')[CENSUS_COLUMNS]
+    fips = cases.index.intersection(census.index)
+    population = census.loc[fips, 'TotalPop'].to_numpy(dtype='float64')
+    covariates = census.loc[fips, COVARIATES].to_numpy(dtype='float64')
+    case_counts = cases.loc[fips].to_numpy()
+    death_counts = deaths.loc[fips].to_numpy()
 
-# Add per capita metrics
-join_df['CasesPerCap'] = join_df['Cases'] / join_df['TotalPop']
-join_df['DeathsPerCap'] = join_df['Deaths'] / join_df['TotalPop']
+    rolling = RollingCorrelation(METRICS + COVARIATES, window or None)
+    dates = []
+    rows = []
+    for i, date in enumerate(cases.columns):
+        per_capita = np.column_stack([case_counts[:, i] / population,
+                                      death_counts[:, i] / population])
+        rolling.add(np.hstack([per_capita, covariates]))
+        if rolling.full():
+            dates.append(date)
+            rows.append(rolling.pairs(PAIRS))
+    if not rows:
+        print(f'Only {cases.shape[1]} dates, fewer than the window of {window}')
+    return pd.DataFrame(rows, index=pd.DatetimeIndex(pd.to_datetime(dates), name='date'),
+                        columns=[f'{x}~{y}' for x, y in PAIRS])
+
+
+def analyze_range(report=None):
+    if Window is not None:
+        if ParquetFile:
+            cases, deaths = long_to_wide(read_range())
+        else:
+            cases, deaths = read_wide(CasesFile, DeathsFile, Start, End)
+        print(f'Number of counties: {len(cases)}, dates: {cases.shape[1]}')
+        correlations = correlate_rolling(cases, deaths, read_census(), Window)
+    else:
+        long_df = read_range()
+        print(f'Number of (county, date) rows: {len(long_df)}')
+        correlations = correlate_by_date(long_df, read_census())
+    print(correlations)
+    if OutputFile:
+        correlations.to_csv(OutputFile)
+    if report and len(correlations):
+        first, last = correlations.index[0], correlations.index[-1]
+        name = f'correlations-{first:%Y-%m-%d}-{last:%Y-%m-%d}'
+        title = 'Correlations per date'
+        if Window is not None:
+            name += f'-w{Window}'
+            title = f'Correlations over {Window} date windows' if Window else 'Correlations, expanding window'
+        report.write(name, correlations, 'lines', title)
+
+
+# cleaned cases, deaths and census frames for date
+def trimmed_stage(date):
+    cases_df, deaths_df, census_df = read_frames(date)
+    print(f'cases_df columns: {cases_df.columns}')
+    print(f'deaths_df columns: {deaths_df.columns}')
+    print(f'census_df columns: {census_df.columns}')
+
+    cases_df, deaths_df, census_df = clean_frames(cases_df, deaths_df, census_df)
+
+    # Count 'Washington County' appearences
+    cases_count = (cases_df['County Name'] == 'Washington County').sum()
+    deaths_count = (deaths_df['County Name'] == 'Washington County').sum()
+    print(f"'Washington County' in cases_df: {cases_count}")
+    print(f"'Washington County' in deaths_df: {deaths_count}")
+
+    print(f'Number of rows in cases_df: {len(cases_df)}')
+    print(f'Number of rows in deaths_df: {len(deaths_df)}')
+    return [cases_df, deaths_df, census_df]
+
+
+def joined_stage(frames, date):
+    cases_df, deaths_df, census_df = frames
+    join_df = add_per_capita(join_on_fips(cases_df, deaths_df, census_df, date))
+    print(f'join_df: \n {join_df.head()}')
+    print(f'Number of rows in join_df: {len(join_df)}')
+    return join_df
+
+
+def correlate(join_df):
+    # Select only numeric columns
+    numeric_df = join_df.select_dtypes(include='number')
+    return numeric_df.corr()
+
+
+# the snapshot correlation matrix for date. With CacheDir each stage's output is kept
+# as an artifact keyed by its inputs and code, and a cached stage is not rerun; a
+# cached correlation matrix means nothing upstream is even loaded. The code version
+# covers the whole source of the modules the stages use, constants and helpers
+# included, so any edit to them reruns every stage
+def snapshot(date):
+    if CacheDir is None:
+        return correlate(joined_stage(trimmed_stage(date), date))
+
+    cache = ArtifactCache(CacheDir, CacheMB * 1024 * 1024)
+    version = code_version(sys.modules[__name__], usafacts, us_state_abbrev)
+    trimmed_key = cache.key(
+        'trimmed', date,
+        cache.file_digest(CasesFile), cache.file_digest(DeathsFile), cache.file_digest(CensusFile),
+        version)
+    joined_key = cache.key('joined', trimmed_key, version)
+    correlation_key = cache.key('correlation', joined_key, version)
+
+    def joined():
+        frames = cache.stage(trimmed_key, ['cases', 'deaths', 'census'],
+                             lambda: trimmed_stage(date))
+        return [joined_stage(frames, date)]
+
+    def correlation():
+        join_df = cache.stage(joined_key, ['joined'], joined)[0]
+        return [correlate(join_df)]
+
+    return cache.stage(correlation_key, ['correlation'], correlation)[0]
+
+
+# interactive heatmap; the plotting libraries are imported only when it is shown
+def show_heatmap(correlation_matrix):
+    import seaborn as sns
+    import matplotlib.pyplot as plt
+
+    sns.heatmap(correlation_matrix, annot=True, cmap='coolwarm', fmt='.2f', linewidths=0.5)
+    plt.title('Correleation Matrix Heatmap')
+    plt.show()
+
+
+def initialize():
+    global Dates, Start, End, ParquetFile, OutputFile, Window, CacheDir, CacheMB, ReportDir
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", "--date", nargs='+', default=Dates,
+                        help="usafacts date columns to analyze, one snapshot each")
+    parser.add_argument("-s", "--start", help="first date of a range to correlate per date")
+    parser.add_argument("-e", "--end", help="last date of the range")
+    parser.add_argument("-p", "--parquet",
+                        help="long table of every date, read if it exists, otherwise written")
+    parser.add_argument("-o", "--output", help="write the per-date correlations to this csv")
+    parser.add_argument("-w", "--window", type=int,
+                        help="correlate over a rolling window of this many dates, updated "
+                             "incrementally; 0 for an expanding window")
+    parser.add_argument("-c", "--cache", help="directory for cached stage artifacts")
+    parser.add_argument("--cache-mb", type=int, default=CacheMB,
+                        help="size cap of the cache directory in MB")
+    parser.add_argument("-r", "--report",
+                        help="headless: write csv/json tables and png/svg charts to this directory")
+    args = parser.parse_args()
+
+    Dates = args.date
+    Start = args.start
+    End = args.end
+    ParquetFile = args.parquet
+    OutputFile = args.output
+    Window = args.window
+    CacheDir = args.cache
+    CacheMB = args.cache_mb
+    ReportDir = args.report
+
+
+def main():
+    initialize()
 
-print(f'join_df: \n {join_df.head()}')
-print(f'Number of rows in join_df: {len(join_df)}')
+    # charts render in a worker process while the next date is computed
+    report = ReportWriter(ReportDir) if ReportDir else None
+    try:
+        if Start or End or ParquetFile or Window is not None:
+            analyze_range(report)
+            return
 
-# Select only numeric columns
-numeric_df = join_df.select_dtypes(include='number')
+        for date in Dates:
+            correlation_matrix = snapshot(date)
+            print(correlation_matrix)
+            if report:
+                report.write(f'correlation-{date}', correlation_matrix, 'heatmap',
+                             f'Correlation Matrix Heatmap {date}')
+            else:
+                show_heatmap(correlation_matrix)
+    finally:
+        if report:
+            report.close()
 
-correlation_matrix = numeric_df.corr()
-print(correlation_matrix)
 
-sns.heatmap(correlation_matrix, annot=True, cmap='coolwarm', fmt='.2f', linewidths=0.5)
-plt.title('Correleation Matrix Heatmap')
-plt.show()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
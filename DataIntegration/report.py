@@ -0,0 +1,72 @@
+# headless report output for main.py. Each table is written as csv and json right
+# away and its chart is rendered on the Agg backend in a background worker process,
+# so matplotlib and seaborn are only imported there and nothing waits on a GUI
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+FORMATS = ['png', 'svg']
+
+
+def render_heatmap(matrix, paths, title):
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib.figure import Figure
+    import seaborn as sns
+
+    fig = Figure(figsize=(9, 7), layout='tight')
+    ax = fig.subplots()
+    sns.heatmap(matrix, annot=True, cmap='coolwarm', fmt='.2f', linewidths=0.5, ax=ax)
+    ax.set_title(title)
+    for path in paths:
+        fig.savefig(path)
+    return paths
+
+
+# one line per column of a date-indexed table
+def render_lines(table, paths, title):
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(11, 6), layout='tight')
+    ax = fig.subplots()
+    for column in table.columns:
+        ax.plot(table.index, table[column], label=column)
+    ax.axhline(0, color='black', linewidth=0.5)
+    ax.set_title(title)
+    ax.set_ylabel('Pearson r')
+    ax.legend(fontsize='small')
+    for path in paths:
+        fig.savefig(path)
+    return paths
+
+
+CHARTS = {
+    'heatmap': render_heatmap,
+    'lines': render_lines,
+}
+
+
+class ReportWriter:
+    def __init__(self, directory, formats=FORMATS):
+        self.directory = directory
+        self.formats = formats
+        os.makedirs(directory, exist_ok=True)
+        self.executor = ProcessPoolExecutor(max_workers=1)
+        self.futures = []
+
+    # write name.csv and name.json now and queue the chart for the worker
+    def write(self, name, table, chart, title):
+        prefix = os.path.join(self.directory, name)
+        table.to_csv(prefix + '.csv')
+        table.to_json(prefix + '.json', orient='split', date_format='iso', indent=1)
+        paths = [f'{prefix}.{fmt}' for fmt in self.formats]
+        self.futures.append(self.executor.submit(CHARTS[chart], table, paths, title))
+        print(f'Wrote {prefix}.csv and {prefix}.json')
+
+    # wait for the queued charts
+    def close(self):
+        for future in self.futures:
+            print(f"Rendered {', '.join(future.result())}")
+        self.executor.shutdown()
@@ -0,0 +1,49 @@
+# Pearson correlations over a sliding window of dates, kept up to date incrementally.
+# Each date contributes its observation count, column sums and cross-product matrix;
+# adding a date adds those to running totals and the date leaving the window is
+# subtracted again, so no window's rows are ever gathered into one frame
+
+import numpy as np
+from collections import deque
+
+
+class RollingCorrelation:
+    # window: dates per window, None to keep every date (an expanding window)
+    def __init__(self, names, window=None):
+        self.names = list(names)
+        self.window = window
+        self.parts = deque()  # (n, sums, cross) of the dates in the window
+        self.n = 0
+        self.sums = np.zeros(len(self.names))
+        self.cross = np.zeros((len(self.names), len(self.names)))
+
+    # add one date's observations, an array with a row per county and a column per
+    # name; rows with a missing value are left out
+    def add(self, values):
+        values = values[~np.isnan(values).any(axis=1)]
+        part = (len(values), values.sum(axis=0), values.T @ values)
+        self.n += part[0]
+        self.sums += part[1]
+        self.cross += part[2]
+        if self.window is not None:
+            self.parts.append(part)
+            if len(self.parts) > self.window:
+                n, sums, cross = self.parts.popleft()
+                self.n -= n
+                self.sums -= sums
+                self.cross -= cross
+
+    def full(self):
+        return self.window is None or len(self.parts) == self.window
+
+    # correlation matrix of everything currently in the window
+    def matrix(self):
+        cov = self.n * self.cross - np.outer(self.sums, self.sums)
+        scale = np.sqrt(np.clip(np.diag(cov), 0.0, None))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return cov / np.outer(scale, scale)
+
+    def pairs(self, pairs):
+        corr = self.matrix()
+        index = {name: i for i, name in enumerate(self.names)}
+        return [corr[index[x], index[y]] for x, y in pairs]
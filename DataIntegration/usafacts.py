@@ -0,0 +1,88 @@
+# loaders for the usafacts wide files, which hold one column per date after the
+# countyFIPS, County Name, State and StateFIPS columns. Either read just the date
+# columns in a range, as int32, or melt them into a long table of
+# (countyFIPS, date, Cases, Deaths) rows that can be kept as Parquet
+
+import numpy as np
+import pandas as pd
+
+ID_COLUMNS = ['countyFIPS', 'County Name', 'State']
+VALUE_DTYPE = 'int32'  # cumulative county counts fit comfortably
+
+
+# the date columns of a usafacts file, read from its header only
+def date_columns(fname):
+    header = pd.read_csv(fname, nrows=0).columns
+    return [column for column in header if column not in ID_COLUMNS and column != 'StateFIPS']
+
+
+# the date columns between start and end (inclusive, YYYY-MM-DD, either may be None)
+def select_dates(fname, start=None, end=None):
+    dates = [date for date in date_columns(fname)
+             if (start is None or date >= start) and (end is None or date <= end)]
+    if not dates:
+        raise ValueError(f"No date columns in {fname} between {start} and {end}")
+    return dates
+
+
+# read only the id columns and the given date columns; names become categoricals
+def read_dates(fname, dates, categorical=True):
+    dtype = {date: VALUE_DTYPE for date in dates}
+    if categorical:
+        dtype.update({'County Name': 'category', 'State': 'category'})
+    return pd.read_csv(fname, usecols=ID_COLUMNS + list(dates), dtype=dtype)[ID_COLUMNS + list(dates)]
+
+
+# county rows of a wide frame indexed by countyFIPS, without the unallocated rows
+def county_rows(wide):
+    wide = wide[wide['County Name'].str.strip() != 'Statewide Unallocated']
+    wide = wide.set_index('countyFIPS')
+    if not wide.index.is_unique:
+        raise ValueError("countyFIPS is not unique once unallocated rows are dropped")
+    return wide
+
+
+# the cases and deaths files restricted to start..end as two int32 frames with a row
+# per county (indexed by countyFIPS, sorted) and a column per date, same shape
+def read_wide(cases_fname, deaths_fname, start=None, end=None):
+    deaths_dates = set(date_columns(deaths_fname))
+    dates = [date for date in select_dates(cases_fname, start, end) if date in deaths_dates]
+    cases = county_rows(read_dates(cases_fname, dates))
+    deaths = county_rows(read_dates(deaths_fname, dates))
+    fips = cases.index.intersection(deaths.index).sort_values()
+    return cases.loc[fips, dates], deaths.loc[fips, dates]
+
+
+# melt the cases and deaths files, restricted to start..end, into one long frame
+# with a row per (countyFIPS, date)
+def read_long(cases_fname, deaths_fname, start=None, end=None):
+    cases, deaths = read_wide(cases_fname, deaths_fname, start, end)
+
+    # the value blocks are (counties, dates); ravel them county-major
+    return pd.DataFrame({
+        'countyFIPS': np.repeat(cases.index.to_numpy(dtype='int32'), cases.shape[1]),
+        'date': np.tile(pd.to_datetime(cases.columns).to_numpy(), len(cases)),
+        'Cases': cases.to_numpy().ravel(),
+        'Deaths': deaths.to_numpy().ravel(),
+    })
+
+
+# the wide (county x date) frames back from a long table
+def long_to_wide(long_df):
+    wide = long_df.pivot(index='countyFIPS', columns='date', values=['Cases', 'Deaths'])
+    wide.columns = wide.columns.set_levels(wide.columns.levels[1].strftime('%Y-%m-%d'), level=1)
+    return wide['Cases'], wide['Deaths']
+
+
+def write_long(long_df, path):
+    long_df.to_parquet(path, index=False)
+
+
+# read a long table back, keeping only the rows between start and end
+def read_long_parquet(path, start=None, end=None):
+    filters = []
+    if start is not None:
+        filters.append(('date', '>=', pd.Timestamp(start)))
+    if end is not None:
+        filters.append(('date', '<=', pd.Timestamp(end)))
+    return pd.read_parquet(path, filters=filters or None)
@@ -1,11 +1,20 @@
-# this program loads Census ACS data using basic, slow INSERTs 
+# this program loads Census ACS data using COPY, or with -b benchmarks
+# several load strategies from basic, slow INSERTs up to parallel COPY
 # run it with -h to see the command line options
 
+import io
+import os
+import math
+import statistics
 import time
 import psycopg2
+import psycopg2.extras
+import psycopg2.pool
 import argparse
 import re
 import csv
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
 DBname = "postgres"
 DBuser = "postgres"
@@ -13,17 +22,79 @@ DBpwd = "password"   # insert your postgres db password here
 TableName = 'censusdata'
 Datafile = "filedoesnotexist"  # name of the data file to be loaded
 CreateDB = False  # indicates whether the DB table should be (re)-created
+Parallel = 0  # number of connections for a parallel COPY, 0 uses a single COPY
+Benchmark = False  # load the file once per strategy and report the results
+ReportFile = None  # benchmark report, .csv or Markdown
+Stream = False  # clean and type rows on their way into COPY
+StateFilter = None  # with Stream, load only the rows of this state
+Upsert = False  # merge the file into the existing table instead of appending
+ManageIndexes = False  # drop indexes before the load and rebuild them after
+Aggregates = False  # build the summary views after loading
+Refresh = False  # only refresh the summary views
+QueryBenchmark = False  # only time the dashboard queries
+
+# session settings for bulk loads: do not wait for the WAL flush on commit
+# and give index builds more memory
+BULK_SETTINGS = {"synchronous_commit": "off", "maintenance_work_mem": "512MB"}
 
 def initialize():
     parser = argparse.ArgumentParser()
-    parser.add_argument("-d", "--datafile", required=True)
+    parser.add_argument("-d", "--datafile")
     parser.add_argument("-c", "--createtable", action="store_true")
+    parser.add_argument("-p", "--parallel", type=int, default=0,
+                        help="COPY byte-range chunks of the file over this many connections")
+    parser.add_argument("-b", "--benchmark", action="store_true",
+                        help="load the file with every strategy into a fresh table")
+    parser.add_argument("-s", "--stream", action="store_true",
+                        help="validate and coerce each row while streaming it into COPY")
+    parser.add_argument("--state", help="with -s, load only rows for this state")
+    parser.add_argument("-u", "--upsert", action="store_true",
+                        help="insert new and update changed rows by TractId, keeping existing rows")
+    parser.add_argument("-i", "--manage-indexes", action="store_true",
+                        help="drop the table's indexes and constraints for the load, "
+                             "rebuild them in parallel and ANALYZE")
+    parser.add_argument("-a", "--aggregates", action="store_true",
+                        help="build the per-state summary views after loading")
+    parser.add_argument("--refresh", action="store_true",
+                        help="refresh the summary views, no data file needed")
+    parser.add_argument("-q", "--query-benchmark", action="store_true",
+                        help="time per-state queries on the table, with and without the State "
+                             "index, and on the summary view, no data file needed")
+    parser.add_argument("-r", "--report", default="load_benchmark.md",
+                        help="benchmark report file (.csv or .md)")
     args = parser.parse_args()
+    if not args.datafile and not (args.refresh or args.query_benchmark):
+        parser.error("the following arguments are required: -d/--datafile")
+    if args.state and not args.stream:
+        parser.error("--state only applies with -s/--stream")
+    if args.upsert and args.manage_indexes:
+        parser.error("-i/--manage-indexes does not apply with -u/--upsert, "
+                     "which needs the table's primary key")
 
     global Datafile
     Datafile = args.datafile
     global CreateDB
     CreateDB = args.createtable
+    global Parallel
+    Parallel = args.parallel
+    global Benchmark
+    Benchmark = args.benchmark
+    global ReportFile
+    ReportFile = args.report
+    global Stream
+    Stream = args.stream
+    global StateFilter
+    StateFilter = args.state
+    global Upsert
+    Upsert = args.upsert
+    global ManageIndexes
+    ManageIndexes = args.manage_indexes
+    global Aggregates
+    Aggregates = args.aggregates
+    global Refresh
+    Refresh = args.refresh
+    global QueryBenchmark
+    QueryBenchmark = args.query_benchmark
 
 
 # read the input data file into a list of row strings
@@ -51,10 +122,12 @@ def dbconnect():
     return connection
 
 
-# create the target table without primary key and index initially
+# create the target table without primary key and index initially. The summary
+# view depends on the table, so it goes too; -a builds it again after the load
 def createTable(conn):
     with conn.cursor() as cursor:
         cursor.execute(f"""
+                DROP MATERIALIZED VIEW IF EXISTS {StateSummary};
                 DROP TABLE IF EXISTS {TableName};
                 CREATE TABLE {TableName} (
                         TractId             NUMERIC,
@@ -128,6 +201,704 @@ def load_with_copy(conn, fname):
             print(f"Finished Loading. Elapsed Time: {elapsed:0.4f} seconds")
 
 
+# convert a DictReader row to a tuple of values, empty fields become NULL
+def row_values(row):
+    return tuple(value if value != '' else None for value in row.values())
+
+
+# columns are matched by position, as COPY does
+def insert_sql():
+    return f"INSERT INTO {TableName} VALUES "
+
+
+# one INSERT statement per row
+def load_with_inserts(conn, fname):
+    rowlist = readdata(fname)
+    sql = insert_sql() + "(" + ", ".join(["%s"] * len(rowlist[0])) + ")"
+    with conn.cursor() as cursor:
+        for row in rowlist:
+            cursor.execute(sql, row_values(row))
+
+
+# one executemany call with all rows
+def load_with_executemany(conn, fname):
+    rowlist = readdata(fname)
+    sql = insert_sql() + "(" + ", ".join(["%s"] * len(rowlist[0])) + ")"
+    with conn.cursor() as cursor:
+        cursor.executemany(sql, [row_values(row) for row in rowlist])
+
+
+# multi-row VALUES lists, page_size rows per statement
+def load_with_execute_values(conn, fname, page_size=1000):
+    rowlist = readdata(fname)
+    with conn.cursor() as cursor:
+        psycopg2.extras.execute_values(
+            cursor, insert_sql() + "%s", [row_values(row) for row in rowlist],
+            page_size=page_size)
+
+
+# COPY from an in-memory CSV of the cleaned and typed rows (see clean_rows), all of
+# them materialized before the COPY starts; copy_stream does the same work row by row
+def load_with_copy_stringio(conn, fname):
+    stats = {"read": 0, "rejected": 0}
+    rowlist = list(clean_rows(fname, column_types(conn), stats))
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+    writer.writerows(rowlist)
+    buf.seek(0)
+    with conn.cursor() as cursor:
+        cursor.copy_expert(f'COPY "{TableName}" FROM STDIN WITH (FORMAT csv, NULL \'\')', buf)
+
+
+NULL_VALUES = {"", "NA", "N/A", "null", "NULL"}
+
+
+# (name, data type) of the target table's columns, in column order
+def table_columns(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("""
+                SELECT column_name, data_type FROM information_schema.columns
+                WHERE table_name = %s ORDER BY ordinal_position;
+        """, (TableName.lower(),))
+        return cursor.fetchall()
+
+
+# data types of the target table's columns, in column order
+def column_types(conn):
+    return [data_type for name, data_type in table_columns(conn)]
+
+
+# coerce one raw CSV field for an INTEGER/NUMERIC/TEXT column, None means NULL.
+# Raise ValueError if the field does not fit the column.
+def coerce_integer(value):
+    value = value.strip()
+    if value in NULL_VALUES:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        number = float(value.replace(",", ""))
+        if not number.is_integer():
+            raise ValueError(f"{value!r} is not an integer")
+        return int(number)
+
+
+def coerce_numeric(value):
+    value = value.strip()
+    if value in NULL_VALUES:
+        return None
+    if "," in value:
+        value = value.replace(",", "")
+    if not math.isfinite(float(value)):
+        raise ValueError(f"{value!r} is not a finite number")
+    return value
+
+
+def coerce_text(value):
+    value = value.strip()
+    return None if value in NULL_VALUES else value
+
+
+COERCERS = {"integer": coerce_integer, "numeric": coerce_numeric}
+
+
+# yield the typed rows of fname one at a time, skipping rows that fail validation
+# or the keep(values) filter; stats counts rows read and rejected
+def clean_rows(fname, types, stats, keep=None):
+    with open(fname, mode="r", newline="") as fil:
+        reader = csv.reader(fil)
+        next(reader)
+        coercers = [COERCERS.get(data_type, coerce_text) for data_type in types]
+        for row in reader:
+            stats["read"] += 1
+            try:
+                if len(row) != len(coercers):
+                    raise ValueError(f"expected {len(coercers)} fields, found {len(row)}")
+                values = [coerce(value) for coerce, value in zip(coercers, row)]
+            except ValueError as err:
+                stats["rejected"] += 1
+                if stats["rejected"] <= 10:
+                    print(f"  rejected line {reader.line_num}: {err}")
+                continue
+            if keep is None or keep(values):
+                yield values
+
+
+# file-like object that renders rows as CSV text only as copy_expert reads it,
+# so no more than one read() worth of rows is in memory at a time
+class CsvRowStream:
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.pending = []
+        self.size = 0
+        self.writer = csv.writer(self, lineterminator="\n")
+
+    # called by csv.writer
+    def write(self, text):
+        self.pending.append(text)
+        self.size += len(text)
+
+    def read(self, size=-1):
+        while size < 0 or self.size < size:
+            row = next(self.rows, None)
+            if row is None:
+                break
+            self.writer.writerow(row)
+
+        data = "".join(self.pending)
+        if 0 <= size < len(data):
+            self.pending = [data[size:]]
+            data = data[:size]
+        else:
+            self.pending = []
+        self.size = len(self.pending[0]) if self.pending else 0
+        return data
+
+
+# COPY the rows of fname through clean_rows, optionally keeping only StateFilter
+def load_with_copy_stream(conn, fname):
+    print(f"Loading data from {fname} using a streaming COPY")
+    types = column_types(conn)
+    keep = None
+    if StateFilter:
+        state = [name for name, data_type in table_columns(conn)].index("state")
+        keep = lambda values: values[state] == StateFilter
+
+    stats = {"read": 0, "rejected": 0}
+    start = time.perf_counter()
+    with conn.cursor() as cursor:
+        sql = f"""
+            COPY "{TableName}" FROM STDIN WITH (
+                FORMAT csv,
+                NULL ''
+            )
+        """
+        cursor.copy_expert(sql, CsvRowStream(clean_rows(fname, types, stats, keep)), size=65536)
+        loaded = cursor.rowcount
+    elapsed = time.perf_counter() - start
+    print(f"Finished Loading. Read {stats['read']} rows, loaded {loaded}, "
+          f"rejected {stats['rejected']}. Elapsed Time: {elapsed:0.4f} seconds")
+
+
+# COPY the file into a temporary staging table, then insert new TractIds and update
+# rows whose contents changed (compared by an md5 hash of the whole row), leaving
+# unchanged rows and the table's indexes alone. Needs the PRIMARY KEY on TractId.
+def load_with_upsert(conn, fname):
+    print(f"Loading data from {fname} using COPY into staging and upsert")
+    # always qualified, so a permanent table of the same name is never touched
+    stage = f"pg_temp.{TableName}_stage"
+    columns = [name for name, data_type in table_columns(conn)]
+    updates = ", ".join(f"{name} = EXCLUDED.{name}" for name in columns if name != "tractid")
+
+    start = time.perf_counter()
+    with conn.cursor() as cursor:
+        cursor.execute(f"""
+                DROP TABLE IF EXISTS {stage};
+                CREATE TEMPORARY TABLE {stage} (LIKE {TableName});
+        """)
+        with open(fname, 'r') as f:
+            sql = f"""
+                COPY {stage} FROM STDIN WITH (
+                    FORMAT csv,
+                    HEADER true,
+                    NULL ''
+                )
+            """
+            cursor.copy_expert(sql, f)
+        staged = cursor.rowcount
+
+        cursor.execute(f"""
+                WITH changed AS (
+                    SELECT DISTINCT ON (s.TractId) s.*
+                    FROM {stage} s LEFT JOIN {TableName} t ON t.TractId = s.TractId
+                    WHERE s.TractId IS NOT NULL
+                      AND (t.TractId IS NULL OR md5(ROW(s.*)::text) <> md5(ROW(t.*)::text))
+                ), upserted AS (
+                    INSERT INTO {TableName} SELECT * FROM changed
+                    ON CONFLICT (TractId) DO UPDATE SET {updates}
+                    RETURNING (xmax = 0) AS inserted
+                )
+                SELECT COUNT(*) FILTER (WHERE inserted), COUNT(*) FILTER (WHERE NOT inserted)
+                FROM upserted;
+        """)
+        inserted, updated = cursor.fetchone()
+        cursor.execute(f"DROP TABLE {stage};")
+
+    elapsed = time.perf_counter() - start
+    print(f"Finished Loading. Staged {staged} rows: {inserted} inserted, {updated} updated, "
+          f"{staged - inserted - updated} unchanged. Elapsed Time: {elapsed:0.4f} seconds")
+    return inserted, updated, staged - inserted - updated
+
+
+# split the data file (after its header line) into about nchunks byte ranges
+# that start and end on line boundaries. Assumes no quoted field spans lines.
+def split_file(fname, nchunks):
+    size = os.path.getsize(fname)
+    with open(fname, "rb") as f:
+        f.readline()
+        start = f.tell()
+        bounds = [start]
+        for i in range(1, nchunks):
+            f.seek(max(start + (size - start) * i // nchunks, bounds[-1]))
+            f.readline()
+            if f.tell() < size and f.tell() > bounds[-1]:
+                bounds.append(f.tell())
+        bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+# file-like view of bytes [start, end) of a file, for copy_expert
+class FileRange:
+    def __init__(self, f, start, end):
+        self.f = f
+        self.remaining = end - start
+        f.seek(start)
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.f.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def readline(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.f.readline(size)
+        self.remaining -= len(data)
+        return data
+
+
+# COPY one byte range of the file into a staging table on a pooled connection,
+# returning (rows, seconds)
+def copy_range(pool, fname, start, end, table):
+    conn = pool.getconn()
+    try:
+        conn.autocommit = True
+        if ManageIndexes:
+            tune_session(conn)
+        with conn.cursor() as cursor, open(fname, "rb") as f:
+            begin = time.perf_counter()
+            sql = f"""
+                COPY "{table}" FROM STDIN WITH (
+                    FORMAT csv,
+                    HEADER false,
+                    NULL ''
+                )
+            """
+            cursor.copy_expert(sql, FileRange(f, start, end))
+            return cursor.rowcount, time.perf_counter() - begin
+    finally:
+        pool.putconn(conn)
+
+
+# staging tables of a parallel load that joined the caller's transaction, which holds
+# locks on them until it ends; the caller drops them with drop_stages after that
+PendingStages = []
+
+
+def drop_stages(conn):
+    with conn.cursor() as cursor:
+        for stage in PendingStages:
+            cursor.execute(f"DROP TABLE IF EXISTS {stage};")
+    PendingStages.clear()
+
+
+# load the file with one COPY per chunk, running nworkers connections at once. Each
+# chunk goes into its own unlogged staging table and the staged rows are moved into
+# the table on conn in a single transaction, so a failed chunk leaves the table as
+# it was. If conn is already in a transaction (see load_with_managed_indexes) the
+# rows join it and the caller commits. The staging tables are named per run so
+# concurrent loads do not share them.
+def load_parallel(conn, fname, nworkers):
+    print(f"Loading data from {fname} using {nworkers} parallel COPY connections")
+    chunks = split_file(fname, nworkers)
+    run = uuid.uuid4().hex[:8]
+    stages = [f"{TableName}_load_{run}_{i}" for i in range(len(chunks))]
+    # spelled out rather than LIKE, which would wait on a caller's lock on the table
+    columns = ", ".join(f"{name} {data_type}" for name, data_type in table_columns(conn))
+    pool = psycopg2.pool.ThreadedConnectionPool(
+        1, nworkers, host="localhost", database=DBname, user=DBuser, password=DBpwd)
+    setup = pool.getconn()
+    try:
+        setup.autocommit = True
+        with setup.cursor() as cursor:
+            for stage in stages:
+                cursor.execute(f"CREATE UNLOGGED TABLE {stage} ({columns});")
+        pool.putconn(setup)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=nworkers) as executor:
+            futures = [executor.submit(copy_range, pool, fname, begin, end, stage)
+                       for (begin, end), stage in zip(chunks, stages)]
+        failed = [(i, future.exception()) for i, future in enumerate(futures) if future.exception()]
+        if failed:
+            for i, err in failed:
+                print(f"  chunk {i} (bytes {chunks[i][0]}-{chunks[i][1]}) failed: {err}")
+            print(f"{len(failed)} of {len(chunks)} chunks failed, nothing was loaded into {TableName}")
+            raise failed[0][1]
+        results = [future.result() for future in futures]
+
+        merge_start = time.perf_counter()
+        if conn.autocommit:
+            conn.autocommit = False
+            try:
+                with conn.cursor() as cursor:
+                    for stage in stages:
+                        cursor.execute(f"INSERT INTO {TableName} SELECT * FROM {stage};")
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                conn.autocommit = True
+        else:
+            PendingStages.extend(stages)
+            stages = []
+            with conn.cursor() as cursor:
+                for stage in PendingStages:
+                    cursor.execute(f"INSERT INTO {TableName} SELECT * FROM {stage};")
+        merged = time.perf_counter() - merge_start
+        elapsed = time.perf_counter() - start
+    finally:
+        cleanup = pool.getconn()
+        cleanup.autocommit = True
+        with cleanup.cursor() as cursor:
+            for stage in stages:
+                cursor.execute(f"DROP TABLE IF EXISTS {stage};")
+        pool.putconn(cleanup)
+        pool.closeall()
+
+    for i, (rows, seconds) in enumerate(results):
+        print(f"  worker {i}: {rows} rows in {seconds:0.4f} seconds ({rows / seconds:0.0f} rows/sec)")
+    total = sum(rows for rows, seconds in results)
+    print(f"  merged {total} staged rows in {merged:0.4f} seconds")
+    print(f"Finished Loading {total} rows. Elapsed Time: {elapsed:0.4f} seconds ({total / elapsed:0.0f} rows/sec)")
+
+
+# load strategies compared by the benchmark, in order from slowest to fastest
+STRATEGIES = {
+    "insert": load_with_inserts,
+    "executemany": load_with_executemany,
+    "execute_values": load_with_execute_values,
+    "copy_file": load_with_copy,
+    "copy_stringio": load_with_copy_stringio,
+    "copy_stream": load_with_copy_stream,
+    "copy_parallel": lambda conn, fname: load_parallel(conn, fname, Parallel or 4),
+}
+
+
+def wal_lsn(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT pg_current_wal_lsn();")
+        return cursor.fetchone()[0]
+
+
+def wal_bytes(conn, start_lsn):
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT pg_wal_lsn_diff(pg_current_wal_lsn(), %s);", (start_lsn,))
+        return int(cursor.fetchone()[0])
+
+
+def count_rows(conn):
+    with conn.cursor() as cursor:
+        cursor.execute(f"SELECT COUNT(*) FROM {TableName};")
+        return cursor.fetchone()[0]
+
+
+# load fname once per strategy into a freshly created table and
+# record elapsed time, rows/sec and WAL bytes generated
+def run_benchmark(conn, fname):
+    results = []
+    for name, load in STRATEGIES.items():
+        createTable(conn)
+        start_lsn = wal_lsn(conn)
+        start = time.perf_counter()
+        load(conn, fname)
+        elapsed = time.perf_counter() - start
+        wal = wal_bytes(conn, start_lsn)
+        rows = count_rows(conn)
+        results.append({"strategy": name, "rows": rows, "seconds": round(elapsed, 4),
+                        "rows_per_sec": round(rows / elapsed), "wal_bytes": wal})
+        print(f"{name}: {rows} rows in {elapsed:0.4f} seconds, {rows / elapsed:0.0f} rows/sec, {wal} WAL bytes")
+    return results
+
+
+# write benchmark results as CSV or as a Markdown table
+def write_report(results, fname):
+    with open(fname, "w", newline="") as f:
+        if fname.endswith(".csv"):
+            writer = csv.DictWriter(f, fieldnames=list(results[0]))
+            writer.writeheader()
+            writer.writerows(results)
+        else:
+            f.write("| " + " | ".join(results[0]) + " |\n")
+            f.write("|" + "---|" * len(results[0]) + "\n")
+            for result in results:
+                f.write("| " + " | ".join(str(value) for value in result.values()) + " |\n")
+    print(f"Wrote benchmark report to {fname}")
+
+
+def tune_session(conn):
+    with conn.cursor() as cursor:
+        for name, value in BULK_SETTINGS.items():
+            cursor.execute(f"SET {name} = %s;", (value,))
+
+
+# the table's plain indexes as [(name, indexdef)] and its PRIMARY KEY, UNIQUE and
+# FOREIGN KEY constraints as [(name, type, constraintdef, indexdef, referenced)],
+# where referenced means another table's foreign key depends on the constraint
+def capture_indexes(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("""
+                SELECT i.relname, pg_get_indexdef(x.indexrelid)
+                FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid
+                WHERE x.indrelid = %s::regclass
+                  AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = x.indexrelid
+                                  AND c.conrelid = x.indrelid);
+        """, (TableName,))
+        indexes = cursor.fetchall()
+
+        cursor.execute("""
+                SELECT c.conname, c.contype, pg_get_constraintdef(c.oid),
+                       CASE WHEN c.contype IN ('p', 'u') THEN pg_get_indexdef(c.conindid) END,
+                       c.contype IN ('p', 'u') AND EXISTS (
+                           SELECT 1 FROM pg_constraint f
+                           WHERE f.contype = 'f' AND f.confrelid = c.conrelid AND f.conindid = c.conindid)
+                FROM pg_constraint c
+                WHERE c.conrelid = %s::regclass AND c.contype IN ('p', 'u', 'f')
+                ORDER BY c.contype DESC;
+        """, (TableName,))
+        constraints = cursor.fetchall()
+    return indexes, constraints
+
+
+# drop the plain indexes and the constraints no other table depends on,
+# returning what was dropped
+def drop_indexes(conn, indexes, constraints):
+    dropped = [con for con in constraints if not con[4]]
+    with conn.cursor() as cursor:
+        for name, contype, condef, indexdef, referenced in dropped:
+            cursor.execute(f'ALTER TABLE {TableName} DROP CONSTRAINT "{name}";')
+        for name, indexdef in indexes:
+            cursor.execute(f'DROP INDEX "{name}";')
+    return indexes, dropped
+
+
+def run_statement(sql):
+    conn = dbconnect()
+    try:
+        tune_session(conn)
+        with conn.cursor() as cursor:
+            cursor.execute(sql)
+    finally:
+        conn.close()
+
+
+# build the plain indexes, each on its own connection at the same time
+def rebuild_indexes(indexes):
+    if indexes:
+        with ThreadPoolExecutor(max_workers=len(indexes)) as executor:
+            list(executor.map(run_statement, [indexdef for name, indexdef in indexes]))
+
+
+# build the unique indexes and add the constraints back (PRIMARY KEY and UNIQUE on
+# indexes built for them) on conn, one at a time
+def rebuild_constraints(conn, indexes, constraints):
+    with conn.cursor() as cursor:
+        for name, indexdef in indexes:
+            cursor.execute(indexdef)
+        for name, contype, condef, indexdef, referenced in constraints:
+            if contype == "p":
+                cursor.execute(indexdef)
+                cursor.execute(f'ALTER TABLE {TableName} ADD CONSTRAINT "{name}" PRIMARY KEY USING INDEX "{name}";')
+            elif contype == "u":
+                cursor.execute(indexdef)
+                cursor.execute(f'ALTER TABLE {TableName} ADD CONSTRAINT "{name}" UNIQUE USING INDEX "{name}";')
+            else:
+                cursor.execute(f'ALTER TABLE {TableName} ADD CONSTRAINT "{name}" {condef};')
+
+
+# after a failed rebuild, build the plain indexes that are still missing one at a time
+def restore_indexes(conn, indexes):
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT indexname FROM pg_indexes WHERE tablename = %s;", (TableName.lower(),))
+        existing = {name for (name,) in cursor.fetchall()}
+        for name, indexdef in indexes:
+            if name in existing:
+                continue
+            try:
+                cursor.execute(indexdef)
+                print(f"Restored {name}")
+            except psycopg2.Error as err:
+                print(f"Could not restore {name}: {err}")
+
+
+def analyze(conn):
+    with conn.cursor() as cursor:
+        cursor.execute(f"ANALYZE {TableName};")
+
+
+# run load(conn, fname) with the table's indexes and constraints dropped and bulk
+# session settings on, then rebuild them and ANALYZE the table, printing the time
+# spent in each phase. The drop, the load and the constraints (with the unique
+# indexes, built on conn) share one transaction, so a load that fails or whose rows
+# break a constraint rolls back to the table as it was. The plain indexes are then
+# built in parallel; any a failure leaves missing are rebuilt one by one.
+def load_with_managed_indexes(conn, fname, load):
+    timings = []
+    started = []
+
+    def phase(name, func, *args):
+        started.append(name)
+        start = time.perf_counter()
+        result = func(*args)
+        timings.append((name, time.perf_counter() - start))
+        return result
+
+    indexes, constraints = phase("capture", capture_indexes, conn)
+    unique = [index for index in indexes if index[1].startswith("CREATE UNIQUE")]
+    plain = [index for index in indexes if index not in unique]
+
+    conn.autocommit = False
+    try:
+        indexes, dropped = phase("drop", drop_indexes, conn, indexes, constraints)
+        kept = [con[0] for con in constraints if con[4]]
+        print(f"Dropped {len(indexes)} indexes and {len(dropped)} constraints"
+              + (f", kept {', '.join(kept)} (referenced by foreign keys)" if kept else ""))
+
+        phase("tune", tune_session, conn)
+        phase("load", load, conn, fname)
+        phase("constraints", rebuild_constraints, conn, unique, dropped)
+        phase("commit", conn.commit)
+    except Exception:
+        conn.rollback()
+        print(f"Phase {started[-1]} failed, rolled back: {TableName} keeps its rows, "
+              "indexes and constraints")
+        raise
+    finally:
+        conn.autocommit = True
+        drop_stages(conn)
+
+    try:
+        phase("rebuild", rebuild_indexes, plain)
+        phase("analyze", analyze, conn)
+    except Exception:
+        print(f"Phase {started[-1]} failed, restoring missing indexes")
+        restore_indexes(conn, plain)
+        raise
+
+    for name, elapsed in timings:
+        print(f"  {name:11} {elapsed:0.4f} seconds")
+    print(f"  {'total':11} {sum(elapsed for name, elapsed in timings):0.4f} seconds")
+
+
+# per-state summary for dashboards; income, poverty and unemployment are
+# weighted by the population of the tracts that report them
+StateSummary = f"{TableName}_state_summary"
+STATE_SUMMARY_SQL = f"""
+        SELECT State,
+               COUNT(*) AS Tracts,
+               COUNT(DISTINCT County) AS Counties,
+               SUM(TotalPop) AS TotalPop,
+               SUM(IncomePerCap * TotalPop)
+                   / NULLIF(SUM(TotalPop) FILTER (WHERE IncomePerCap IS NOT NULL), 0) AS IncomePerCap,
+               SUM(Poverty * TotalPop)
+                   / NULLIF(SUM(TotalPop) FILTER (WHERE Poverty IS NOT NULL), 0) AS Poverty,
+               SUM(Unemployment * TotalPop)
+                   / NULLIF(SUM(TotalPop) FILTER (WHERE Unemployment IS NOT NULL), 0) AS Unemployment
+        FROM {TableName}
+        GROUP BY State
+"""
+
+
+# (re)create the summary view, with a unique index so it can be refreshed concurrently
+def create_aggregates(conn):
+    start = time.perf_counter()
+    with conn.cursor() as cursor:
+        cursor.execute(f"""
+                DROP MATERIALIZED VIEW IF EXISTS {StateSummary};
+                CREATE MATERIALIZED VIEW {StateSummary} AS {STATE_SUMMARY_SQL};
+                CREATE UNIQUE INDEX idx_{StateSummary}_State ON {StateSummary}(State);
+        """)
+    elapsed = time.perf_counter() - start
+    print(f"Created {StateSummary}. Elapsed Time: {elapsed:0.4f} seconds")
+
+
+# recompute the summary view without blocking readers
+def refresh_aggregates(conn):
+    start = time.perf_counter()
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s);", (StateSummary,))
+        if cursor.fetchone()[0] is None:
+            print(f"{StateSummary} does not exist, load with -a to build it")
+            return
+        cursor.execute(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {StateSummary};")
+    elapsed = time.perf_counter() - start
+    print(f"Refreshed {StateSummary}. Elapsed Time: {elapsed:0.4f} seconds")
+
+
+# dashboard queries: (name, query on the table, same query on the summary view)
+DASHBOARD_QUERIES = [
+    ("counties in Oregon",
+     f"SELECT COUNT(DISTINCT county) FROM {TableName} WHERE state = 'Oregon';",
+     f"SELECT Counties FROM {StateSummary} WHERE State = 'Oregon';"),
+    ("counties in Iowa",
+     f"SELECT COUNT(DISTINCT county) FROM {TableName} WHERE state = 'Iowa';",
+     f"SELECT Counties FROM {StateSummary} WHERE State = 'Iowa';"),
+    ("tracts and counties per state",
+     f"SELECT state, COUNT(*), COUNT(DISTINCT county) FROM {TableName} GROUP BY state;",
+     f"SELECT State, Tracts, Counties FROM {StateSummary};"),
+    ("weighted income per state",
+     f"SELECT state, SUM(IncomePerCap * TotalPop) / NULLIF(SUM(TotalPop) FILTER "
+     f"(WHERE IncomePerCap IS NOT NULL), 0) FROM {TableName} GROUP BY state;",
+     f"SELECT State, IncomePerCap FROM {StateSummary};"),
+]
+
+
+# median milliseconds of running sql repeats times
+def time_query(cursor, sql, repeats):
+    times = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        cursor.execute(sql)
+        cursor.fetchall()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+# time the dashboard queries on the table with and without idx_censusdata_State and on
+# the summary view. Index changes are made in a transaction that is rolled back.
+def run_query_benchmark(conn, repeats=20):
+    index = f"idx_{TableName}_State"
+    bench = dbconnect()
+    bench.autocommit = False
+    results = {}
+    with bench.cursor() as cursor:
+        for label, ddl in (("with index", f"CREATE INDEX IF NOT EXISTS {index} ON {TableName}(State);"),
+                           ("without index", f"DROP INDEX IF EXISTS {index};")):
+            cursor.execute(ddl)
+            for name, table_sql, summary_sql in DASHBOARD_QUERIES:
+                results.setdefault(name, {})[label] = time_query(cursor, table_sql, repeats)
+            bench.rollback()
+
+        cursor.execute("SELECT to_regclass(%s);", (StateSummary,))
+        has_summary = cursor.fetchone()[0] is not None
+        if has_summary:
+            for name, table_sql, summary_sql in DASHBOARD_QUERIES:
+                results[name]["summary view"] = time_query(cursor, summary_sql, repeats)
+        bench.rollback()
+    bench.close()
+
+    labels = ["with index", "without index"] + (["summary view"] if has_summary else [])
+    print(f"Median query latency over {repeats} runs (ms):")
+    print(f"{'query':32}" + "".join(f"{label:>16}" for label in labels))
+    for name, timings in results.items():
+        print(f"{name:32}" + "".join(f"{timings[label]:16.3f}" for label in labels))
+    if not has_summary:
+        print(f"{StateSummary} does not exist, load with -a to build it")
+
+
 # function to verify data in the database
 def verify_data(conn):
     with conn.cursor() as cursor:
@@ -149,14 +920,43 @@ def main():
     initialize()
     conn = dbconnect()
 
+    if Benchmark:
+        write_report(run_benchmark(conn, Datafile), ReportFile)
+        return
+
+    if Refresh or QueryBenchmark:
+        if Refresh:
+            refresh_aggregates(conn)
+        if QueryBenchmark:
+            run_query_benchmark(conn)
+        return
+
     if CreateDB:
         createTable(conn)
+        # the upsert needs the primary key in place before loading
+        if Upsert:
+            add_constraints_and_indexes(conn)
 
-    load_with_copy(conn, Datafile)
+    if Upsert:
+        load = load_with_upsert
+    elif Parallel:
+        load = lambda conn, fname: load_parallel(conn, fname, Parallel)
+    elif Stream:
+        load = load_with_copy_stream
+    else:
+        load = load_with_copy
 
-    if CreateDB:
+    if ManageIndexes:
+        load_with_managed_indexes(conn, Datafile, load)
+    else:
+        load(conn, Datafile)
+
+    if CreateDB and not Upsert:
         add_constraints_and_indexes(conn)
 
+    if Aggregates:
+        create_aggregates(conn)
+
     verify_data(conn)
 
 
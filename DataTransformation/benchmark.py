@@ -0,0 +1,66 @@
+# this program compares the row-wise apply transform against the columnar one
+# run it with -h to see the command line options
+
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+from breadcrumbs import DROP_COLUMNS, transform
+
+Datafile = "bc_trip259172515_230215.csv"
+
+
+# build a synthetic frame by repeating the sample trip, one trip number per copy
+def make_data(fname, scale):
+    sample = pd.read_csv(fname)
+    data = pd.concat([sample] * scale, ignore_index=True)
+    data["EVENT_NO_TRIP"] += np.repeat(np.arange(scale), len(sample))
+    return data
+
+
+# original apply-based path, kept here as the baseline
+def transform_apply(data):
+    data = data.drop(columns=DROP_COLUMNS)
+
+    def compute_timestamp(row):
+        base_date = datetime.strptime(row["OPD_DATE"], "%d%b%Y:%H:%M:%S")
+        time_offset = timedelta(seconds=int(row["ACT_TIME"]))
+        return base_date + time_offset
+
+    data["TIMESTAMP"] = data.apply(compute_timestamp, axis=1)
+    data = data.drop(columns=["OPD_DATE", "ACT_TIME"])
+
+    data["dMETERS"] = data["METERS"].diff()
+    data["dTIMESTAMP"] = data["TIMESTAMP"].diff().dt.total_seconds()
+    data["SPEED"] = data.apply(lambda row: row["dMETERS"] / row["dTIMESTAMP"] if pd.notnull(row["dMETERS"]) and row["dTIMESTAMP"] > 0 else 0, axis=1)
+    return data.drop(columns=["dMETERS", "dTIMESTAMP"])
+
+
+def timed(func, data):
+    start = time.perf_counter()
+    result = func(data)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", "--datafile", default=Datafile)
+    parser.add_argument("-s", "--scale", type=int, default=1000)
+    args = parser.parse_args()
+
+    data = make_data(args.datafile, args.scale)
+    print(f"Benchmarking {len(data)} breadcrumb records ({args.scale}x {args.datafile})")
+
+    slow, slow_elapsed = timed(transform_apply, data)
+    fast, fast_elapsed = timed(transform, data)
+
+    same = (slow["TIMESTAMP"].equals(fast["TIMESTAMP"])
+            and np.allclose(slow["SPEED"].to_numpy(dtype="float64"), fast["SPEED"].to_numpy()))
+    print(f"apply:    {slow_elapsed:0.4f} seconds")
+    print(f"columnar: {fast_elapsed:0.4f} seconds")
+    print(f"Speedup: {slow_elapsed / fast_elapsed:0.1f}x, results match: {same}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+import numpy as np
+import pandas as pd
+
+DROP_COLUMNS = ["EVENT_NO_STOP", "GPS_SATELLITES", "GPS_HDOP"]
+OPD_DATE_FORMAT = "%d%b%Y:%H:%M:%S"
+TRIP_KEYS = ["VEHICLE_ID", "EVENT_NO_TRIP"]
+CHUNKSIZE = 100000  # rows per chunk in streaming mode
+
+
+# Read a breadcrumb CSV, or an NDJSON file (.ndjson/.jsonl, optionally .gz/.zst) as
+# streamed by DataTransport/fetch.py. With a chunksize an iterator of frames is returned.
+def read_breadcrumbs(fname, chunksize=None):
+    if fname.removesuffix(".gz").removesuffix(".zst").endswith((".ndjson", ".jsonl")):
+        return pd.read_json(fname, lines=True, chunksize=chunksize,
+                            convert_dates=False, keep_default_dates=False)
+    return pd.read_csv(fname, chunksize=chunksize)
+
+
+# Parse OPD_DATE into datetime64 values, calling the parser once per distinct date
+def parse_opd_date(opd_date):
+    codes, dates = pd.factorize(opd_date)
+    base = pd.to_datetime(dates, format=OPD_DATE_FORMAT).values
+
+    parsed = base[codes]
+    parsed[codes < 0] = np.datetime64("NaT")
+    return parsed
+
+
+# Compute TIMESTAMP from OPD_DATE and ACT_TIME without a per-row strptime.
+# Each distinct OPD_DATE is parsed once and ACT_TIME is added as a timedelta array.
+def compute_timestamp(data):
+    offset = data["ACT_TIME"].to_numpy(dtype="int64").astype("timedelta64[s]")
+    stamps = parse_opd_date(data["OPD_DATE"]) + offset
+    return pd.Series(stamps, index=data.index, name="TIMESTAMP")
+
+
+# Mark the first row of every (VEHICLE_ID, EVENT_NO_TRIP) run in a frame sorted by those keys
+def segment_starts(data, keys=TRIP_KEYS):
+    starts = np.zeros(len(data), dtype=bool)
+    starts[:1] = True
+    for key in keys:
+        values = data[key].to_numpy()
+        starts[1:] |= values[1:] != values[:-1]
+    return starts
+
+
+# Compute dMETERS and dTIMESTAMP (seconds) between consecutive rows.
+# Deltas are NaN on the first row and on every row flagged in starts.
+def compute_deltas(meters, timestamps, starts=None):
+    meters = np.asarray(meters, dtype="float64")
+    stamps = np.asarray(timestamps, dtype="datetime64[ns]")
+    seconds = stamps.view("int64") / 1e9
+    seconds[np.isnat(stamps)] = np.nan
+
+    d_meters = np.diff(meters, prepend=np.nan)
+    d_seconds = np.diff(seconds, prepend=np.nan)
+    if starts is not None:
+        d_meters[starts] = np.nan
+        d_seconds[starts] = np.nan
+    return d_meters, d_seconds
+
+
+# Compute SPEED (m/s) from the deltas of consecutive METERS and TIMESTAMP values.
+# Rows with no previous reading or a non-positive time step get a speed of 0.
+def compute_speed(meters, timestamps, starts=None):
+    d_meters, d_seconds = compute_deltas(meters, timestamps, starts)
+    valid = ~np.isnan(d_meters) & (d_seconds > 0)
+
+    speed = np.zeros(len(d_meters))
+    np.divide(d_meters, d_seconds, out=speed, where=valid)
+    return speed
+
+
+# Drop unwanted columns and replace OPD_DATE/ACT_TIME with TIMESTAMP.
+# With keep_source OPD_DATE (parsed to a date) and ACT_TIME are kept alongside it.
+def add_timestamp(data, keep_source=False):
+    data = data.drop(columns=DROP_COLUMNS)
+    data["TIMESTAMP"] = compute_timestamp(data)
+    if keep_source:
+        data["OPD_DATE"] = parse_opd_date(data["OPD_DATE"])
+        return data
+    return data.drop(columns=["OPD_DATE", "ACT_TIME"])
+
+
+# Drop unwanted columns and replace OPD_DATE/ACT_TIME with TIMESTAMP and SPEED.
+# Rows are grouped by trip with one stable sort so deltas never cross a trip or vehicle.
+def transform(data, keep_source=False):
+    data = add_timestamp(data, keep_source).sort_values(TRIP_KEYS, kind="stable")
+    starts = segment_starts(data)
+    data["SPEED"] = compute_speed(data["METERS"], data["TIMESTAMP"], starts)
+    return data
+
+
+# Transform a breadcrumb file chunk by chunk, yielding each transformed chunk.
+# The last row of every trip is carried into the next chunk so deltas stay correct
+# across chunk boundaries; only one chunk plus one row per trip is held in memory.
+def transform_chunks(fname, chunksize=CHUNKSIZE, keep_source=False):
+    carry = None
+    for chunk in read_breadcrumbs(fname, chunksize):
+        # a file with only a header still gives one empty chunk
+        if chunk.empty:
+            continue
+        data = add_timestamp(chunk, keep_source)
+
+        # Prepend carried rows (marked with index -1) for trips that continue in this chunk
+        if carry is not None:
+            context = carry[carry.index.isin(pd.MultiIndex.from_frame(data[TRIP_KEYS]))]
+            context = context.reset_index().set_axis(np.full(len(context), -1))
+            data = pd.concat([context[data.columns], data])
+
+        data = data.sort_values(TRIP_KEYS, kind="stable")
+        starts = segment_starts(data)
+        data["SPEED"] = compute_speed(data["METERS"], data["TIMESTAMP"], starts)
+        data = data[data.index >= 0]
+
+        # Remember the last row of each trip for the next chunk
+        ends = np.append(segment_starts(data)[1:], True)
+        last = data[ends].drop(columns="SPEED").set_index(TRIP_KEYS)
+        if carry is None:
+            carry = last
+        else:
+            carry = pd.concat([carry[~carry.index.isin(last.index)], last])
+
+        yield data
+
+
+# Fold the SPEED column of a transformed frame into running per-trip totals
+def update_trip_summary(summary, data):
+    part = data.groupby(TRIP_KEYS, sort=False)["SPEED"].agg(["count", "min", "max", "sum"])
+    if summary is None:
+        return part
+    return pd.concat([summary, part]).groupby(level=TRIP_KEYS, sort=False).agg(
+        {"count": "sum", "min": "min", "max": "max", "sum": "sum"})
+
+
+# Turn running per-trip totals into a min/max/mean SPEED table.
+# summary is None when no rows were read, which gives an empty table
+def finish_trip_summary(summary):
+    if summary is None:
+        return pd.DataFrame(columns=["RECORDS", "MIN_SPEED", "MAX_SPEED", "AVG_SPEED"])
+    summary = summary.assign(mean=summary["sum"] / summary["count"]).drop(columns="sum")
+    return summary.rename(columns={"count": "RECORDS", "min": "MIN_SPEED",
+                                   "max": "MAX_SPEED", "mean": "AVG_SPEED"})
+
+
+# Per-trip min/max/mean SPEED of a transformed frame
+def trip_speed_summary(data):
+    return finish_trip_summary(update_trip_summary(None, data))
@@ -1,42 +1,80 @@
-import pandas as pd
-from datetime import datetime, timedelta
+# this program computes TIMESTAMP and SPEED for TriMet breadcrumb data
+# run it with -h to see the command line options
 
-# Read data and drop unwanted columns
-data = pd.read_csv("bc_trip259172515_230215.csv")
-data = data.drop(columns=["EVENT_NO_STOP", "GPS_SATELLITES", "GPS_HDOP"])
+import argparse
+from breadcrumbs import read_breadcrumbs, transform, transform_chunks, update_trip_summary, finish_trip_summary
+from parquet_store import is_empty, write_parquet
 
-#data = pd.read_csv("bc_trip259172515_230215.csv", usecols=[
-#    "EVENT_NO_STOP", "GPS_SATELLITES", "GPS_HDOP", "OPD_DATE", "ACT_TIME"
-#])
+Datafile = "bc_trip259172515_230215.csv"
+ChunkSize = None  # rows per chunk in streaming mode, None loads the whole file
+OutputDir = None  # Parquet dataset to write the transformed records to
 
-# Compute timestamp from ODP_DATE and ACT_TIME
-def compute_timestamp(row):
-    base_date = datetime.strptime(row["OPD_DATE"], "%d%b%Y:%H:%M:%S")
-    time_offset = timedelta(seconds=int(row["ACT_TIME"]))
-    return base_date + time_offset
 
-data["TIMESTAMP"] = data.apply(compute_timestamp, axis=1)
-data = data.drop(columns=["OPD_DATE", "ACT_TIME"])
+def initialize():
+    global Datafile
+    global ChunkSize
+    global OutputDir
 
-# Compute differences
-data["dMETERS"] = data["METERS"].diff()
-data["dTIMESTAMP"] = data["TIMESTAMP"].diff().dt.total_seconds()  # Convert timedelta to seconds
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", "--datafile", default=Datafile)
+    parser.add_argument("-c", "--chunksize", type=int,
+                        help="stream the file in chunks of this many rows")
+    parser.add_argument("-o", "--output",
+                        help="write a Parquet dataset partitioned by OPD_DATE and VEHICLE_ID")
+    args = parser.parse_args()
+    if args.output and not is_empty(args.output):
+        parser.error(f"{args.output} is not empty, remove it or choose another directory")
 
-# Compute SPEED
-data["SPEED"] = data.apply(lambda row: row["dMETERS"] / row["dTIMESTAMP"] if pd.notnull(row["dMETERS"]) and row["dTIMESTAMP"] > 0 else 0, axis=1)
+    Datafile = args.datafile
+    ChunkSize = args.chunksize
+    OutputDir = args.output
 
-# Drop dMETERS and dTIMESTAMP columns
-data = data.drop(columns=["dMETERS", "dTIMESTAMP"])
 
-min = data["SPEED"].min()
-max = data["SPEED"].max()
-avg = data["SPEED"].mean()
+def main():
+    initialize()
 
-# Print total breadcrumb records & data
-print(data)
-print(f"Number of breadcrumb records: {len(data)}")
+    # Read data, drop unwanted columns and compute TIMESTAMP & SPEED.
+    # OPD_DATE and ACT_TIME are kept when writing Parquet since they are stored too.
+    keep_source = OutputDir is not None
+    if ChunkSize:
+        records = 0
+        summary = None
+        for data in transform_chunks(Datafile, ChunkSize, keep_source):
+            records += len(data)
+            summary = update_trip_summary(summary, data)
+            if OutputDir:
+                write_parquet(data, OutputDir)
+    else:
+        data = transform(read_breadcrumbs(Datafile), keep_source)
+        records = len(data)
+        summary = update_trip_summary(None, data)
+        if OutputDir:
+            write_parquet(data, OutputDir)
 
-# Print min, max, & avg speeds
-print(f"Minimum Speed: {min} m/s")
-print(f"Maximum Speed: {max} m/s")
-print(f"Average Speed: {avg} m/s")
+        # Print breadcrumb data
+        print(data)
+
+    # An empty file (chunk mode yields no chunks at all)
+    if summary is None:
+        print("Number of breadcrumb records: 0")
+        print(finish_trip_summary(summary))
+        return
+
+    min = summary["min"].min()
+    max = summary["max"].max()
+    avg = summary["sum"].sum() / summary["count"].sum()
+
+    # Print total breadcrumb records
+    print(f"Number of breadcrumb records: {records}")
+
+    # Print min, max, & avg speeds
+    print(f"Minimum Speed: {min} m/s")
+    print(f"Maximum Speed: {max} m/s")
+    print(f"Average Speed: {avg} m/s")
+
+    # Print min, max, & avg speeds per trip
+    print(finish_trip_summary(summary))
+
+
+if __name__ == "__main__":
+    main()
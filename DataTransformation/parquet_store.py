@@ -0,0 +1,46 @@
+import os
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+PARTITION_COLUMNS = ["OPD_DATE", "VEHICLE_ID"]
+
+# Compact on-disk schema for transformed breadcrumbs
+SCHEMA = pa.schema([
+    ("EVENT_NO_TRIP", pa.int64()),
+    ("METERS", pa.int32()),
+    ("ACT_TIME", pa.int32()),
+    ("GPS_LONGITUDE", pa.float32()),
+    ("GPS_LATITUDE", pa.float32()),
+    ("TIMESTAMP", pa.timestamp("s")),
+    ("SPEED", pa.float32()),
+    ("OPD_DATE", pa.date32()),
+    ("VEHICLE_ID", pa.int32()),
+])
+
+PARTITIONING = ds.partitioning(
+    pa.schema([field for field in SCHEMA if field.name in PARTITION_COLUMNS]), flavor="hive")
+
+
+# True if path does not exist yet or is an empty directory. main.py only writes into
+# such a path, since write_parquet adds files and rerunning would duplicate the rows.
+def is_empty(path):
+    return not os.path.exists(path) or (os.path.isdir(path) and not os.listdir(path))
+
+
+# Append a frame produced by transform(data, keep_source=True) to a Parquet dataset
+# partitioned by OPD_DATE and VEHICLE_ID. Each call adds new files to the partitions.
+# Casts to the narrower SCHEMA types are checked, so out-of-range values raise.
+def write_parquet(data, path):
+    table = pa.Table.from_pandas(data[SCHEMA.names], schema=SCHEMA, preserve_index=False)
+    pq.write_to_dataset(table, path, partitioning=PARTITIONING,
+                        existing_data_behavior="overwrite_or_ignore")
+
+
+# Read a breadcrumb Parquet dataset back into a frame, OPD_DATE as datetime64.
+# columns limits which columns are decoded and filters (e.g. [("VEHICLE_ID", "=", 4223)])
+# are pushed down so non-matching partitions and row groups are skipped.
+def read_parquet(path, columns=None, filters=None):
+    table = pq.read_table(path, columns=columns, filters=filters,
+                          partitioning=PARTITIONING, schema=SCHEMA)
+    return table.to_pandas(date_as_object=False)
@@ -0,0 +1,120 @@
+# encoders/decoders for breadcrumb messages shared by publisher.py and subscriber.py.
+# A message carries one or more records; its "codec" attribute names the encoding
+# and the struct codec also sets a "schema" attribute with the schema id.
+
+import json
+import struct
+from datetime import datetime, timezone
+from functools import lru_cache
+
+OPD_DATE_FORMAT = "%d%b%Y:%H:%M:%S"
+
+# fixed binary schema: (field, struct format) in wire order, after a uint16 null mask
+SCHEMA_ID = "breadcrumb-v1"
+FIELDS = [
+    ("EVENT_NO_TRIP", "q"),
+    ("EVENT_NO_STOP", "q"),
+    ("OPD_DATE", "I"),  # seconds since the epoch
+    ("VEHICLE_ID", "i"),
+    ("METERS", "i"),
+    ("ACT_TIME", "i"),
+    ("GPS_LONGITUDE", "d"),
+    ("GPS_LATITUDE", "d"),
+    ("GPS_SATELLITES", "B"),
+    ("GPS_HDOP", "d"),
+]
+NAMES = [name for name, fmt in FIELDS]
+RECORD = struct.Struct("<H" + "".join(fmt for name, fmt in FIELDS))
+
+
+@lru_cache(maxsize=1024)
+def opd_date_to_epoch(opd_date):
+    parsed = datetime.strptime(opd_date, OPD_DATE_FORMAT).replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp())
+
+
+@lru_cache(maxsize=1024)
+def epoch_to_opd_date(seconds):
+    return datetime.fromtimestamp(seconds, timezone.utc).strftime(OPD_DATE_FORMAT).upper()
+
+
+def encode_json(records):
+    # a single record is sent bare, as the original publisher did
+    payload = records[0] if len(records) == 1 else records
+    return json.dumps(payload).encode("utf-8")
+
+
+def decode_json(data):
+    payload = json.loads(data)
+    return payload if isinstance(payload, list) else [payload]
+
+
+def encode_struct(records):
+    out = bytearray()
+    for record in records:
+        mask = 0
+        values = []
+        for i, (name, fmt) in enumerate(FIELDS):
+            value = record.get(name)
+            if value is None or value != value:
+                mask |= 1 << i
+                value = 0
+            elif name == "OPD_DATE":
+                value = opd_date_to_epoch(value)
+            elif fmt != "d":
+                value = int(value)
+            values.append(value)
+        out += RECORD.pack(mask, *values)
+    return bytes(out)
+
+
+def decode_struct(data):
+    records = []
+    for mask, *values in RECORD.iter_unpack(data):
+        record = dict(zip(NAMES, values))
+        record["OPD_DATE"] = epoch_to_opd_date(record["OPD_DATE"])
+        record["GPS_SATELLITES"] = float(record["GPS_SATELLITES"])
+        if mask:
+            for i, name in enumerate(NAMES):
+                if mask & (1 << i):
+                    record[name] = None
+        records.append(record)
+    return records
+
+
+# group records into lists of up to pack records, one list per message
+def pack_records(records, pack):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == pack:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# codec name -> (encode(records) -> bytes, decode(bytes) -> records)
+CODECS = {
+    "json": (encode_json, decode_json),
+    "struct": (encode_struct, decode_struct),
+}
+
+
+# encode a list of records, returning the payload and the message attributes
+def encode(records, codec="json"):
+    encoder = CODECS[codec][0]
+    attributes = {"codec": codec, "records": str(len(records))}
+    if codec == "struct":
+        attributes["schema"] = SCHEMA_ID
+    return encoder(records), attributes
+
+
+# decode a received Pub/Sub message into its records, using its codec attribute.
+# Messages without one are treated as JSON.
+def decode_message(message):
+    codec = message.attributes.get("codec", "json")
+    if codec == "struct" and message.attributes.get("schema", SCHEMA_ID) != SCHEMA_ID:
+        raise ValueError(f"Unknown breadcrumb schema {message.attributes['schema']}")
+    decoder = CODECS[codec][1]
+    return decoder(message.data)
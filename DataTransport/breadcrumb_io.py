@@ -0,0 +1,57 @@
+import gzip
+import io
+import json
+
+# extensions written as newline-delimited JSON, one compact record per line
+NDJSON_SUFFIXES = (".ndjson", ".jsonl")
+
+
+def is_ndjson(fname):
+    return strip_compression(fname).endswith(NDJSON_SUFFIXES)
+
+
+def strip_compression(fname):
+    for suffix in (".gz", ".zst"):
+        if fname.endswith(suffix):
+            return fname[:-len(suffix)]
+    return fname
+
+
+# open a text stream, compressing or decompressing based on a .gz or .zst extension
+def open_text(fname, mode="r"):
+    if fname.endswith(".gz"):
+        return gzip.open(fname, mode + "t", encoding="utf-8")
+    if fname.endswith(".zst"):
+        import zstandard  # only needed for .zst files
+
+        raw = open(fname, mode + "b")
+        if mode == "r":
+            stream = zstandard.ZstdDecompressor().stream_reader(raw, closefd=True)
+        else:
+            stream = zstandard.ZstdCompressor().stream_writer(raw, closefd=True)
+        return io.TextIOWrapper(stream, encoding="utf-8")
+    return open(fname, mode, encoding="utf-8")
+
+
+# write records to an open NDJSON stream, returning how many were written
+def write_records(file, records):
+    count = 0
+    for record in records:
+        file.write(json.dumps(record, separators=(",", ":")))
+        file.write("\n")
+        count += 1
+    return count
+
+
+# yield breadcrumb records one at a time from an NDJSON file (optionally compressed).
+# A plain JSON array such as the old bcsample.json is still accepted, but is loaded whole.
+def read_records(fname):
+    if not is_ndjson(fname):
+        with open_text(fname) as f:
+            yield from json.load(f)
+        return
+
+    with open_text(fname) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
@@ -0,0 +1,38 @@
+# this program compares message size and encode/decode time of the breadcrumb codecs
+# run it with -h to see the command line options
+
+import time
+import argparse
+from breadcrumb_codec import CODECS, pack_records
+from breadcrumb_io import read_records
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", "--datafile", default="bcsample.json")
+    parser.add_argument("-p", "--pack", type=int, default=1,
+                        help="number of breadcrumbs packed into each message")
+    args = parser.parse_args()
+
+    batches = list(pack_records(read_records(args.datafile), args.pack))
+    records = sum(len(batch) for batch in batches)
+    print(f"{records} breadcrumbs in {len(batches)} messages of up to {args.pack}")
+    print(f"{'codec':8} {'bytes/record':>12} {'encode/s':>12} {'decode/s':>12}")
+
+    for name, (encoder, decoder) in CODECS.items():
+        start = time.perf_counter()
+        payloads = [encoder(batch) for batch in batches]
+        encode_elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        decoded = [record for payload in payloads for record in decoder(payload)]
+        decode_elapsed = time.perf_counter() - start
+
+        size = sum(len(payload) for payload in payloads)
+        assert len(decoded) == records
+        print(f"{name:8} {size / records:12.1f} {records / encode_elapsed:12.0f} "
+              f"{records / decode_elapsed:12.0f}")
+
+
+if __name__ == "__main__":
+    main()
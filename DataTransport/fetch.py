@@ -1,27 +1,167 @@
+# this program fetches TriMet breadcrumbs for a list of vehicles into bcsample.json
+# (or, with a .ndjson/.jsonl outfile, optionally .gz/.zst, streams them as NDJSON)
+# run it with -h to see the command line options
+
 import urllib.request
 import urllib.parse
+import urllib.error
+import http.client
+import threading
+import argparse
+import random
+import time
 import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from breadcrumb_io import is_ndjson, open_text, write_records
+
+BaseURL = "https://busdata.cs.pdx.edu/api/getBreadCrumbs"
+Outfile = "bcsample.json"
+VehicleIDs = [2907, 3055]
+Workers = None  # size of the concurrent fetch pool, None fetches serially
+Retries = 3  # extra attempts per vehicle in concurrent mode
+Backoff = 0.5  # seconds before the first retry, doubled on every attempt
+Timeout = 30.0
+
+# one keep-alive connection per fetch thread
+_local = threading.local()
+
 
-def fetchData(vehicleID):
-    url = f"https://busdata.cs.pdx.edu/api/getBreadCrumbs?vehicle_id={urllib.parse.quote(str(vehicleID))}"
+def breadcrumb_url(vehicleID, base_url=BaseURL):
+    return f"{base_url}?vehicle_id={urllib.parse.quote(str(vehicleID))}"
+
+
+def fetchData(vehicleID, base_url=BaseURL):
+    url = breadcrumb_url(vehicleID, base_url)
     try:
         response = urllib.request.urlopen(url)
         data = response.read()
-        return json.loads(data)  
+        return json.loads(data)
     except urllib.error.HTTPError as err:
         print(f"HTTPError for vehicle {vehicleID}: {err.code} - {err.reason}")
     except urllib.error.URLError as err:
         print(f"URLError for vehicle {vehicleID}: {err.reason}")
     except Exception as err:
         print(f"Unexpected error for vehicle {vehicleID}: {err}")
-    return []  
+    return []
+
+
+# return this thread's connection to the host in url, opening it if needed
+def get_connection(url, timeout=Timeout):
+    parts = urllib.parse.urlsplit(url)
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.netloc != parts.netloc:
+        if conn is not None:
+            conn.close()
+        if parts.scheme == "https":
+            conn = http.client.HTTPSConnection(parts.netloc, timeout=timeout)
+        else:
+            conn = http.client.HTTPConnection(parts.netloc, timeout=timeout)
+        _local.conn = conn
+        _local.netloc = parts.netloc
+    return conn
+
+
+# GET url over the thread's keep-alive connection, raising the same errors as urlopen
+def get(url, timeout=Timeout):
+    parts = urllib.parse.urlsplit(url)
+    conn = get_connection(url, timeout)
+    try:
+        conn.request("GET", f"{parts.path}?{parts.query}", headers={"Connection": "keep-alive"})
+        response = conn.getresponse()
+        data = response.read()
+    except (OSError, http.client.HTTPException) as err:
+        conn.close()
+        raise urllib.error.URLError(err)
+
+    if response.status != 200:
+        raise urllib.error.HTTPError(url, response.status, response.reason, response.headers, None)
+    return data
+
+
+# fetch one vehicle, retrying with exponential backoff on server and network errors
+def fetch_with_retry(vehicleID, base_url=BaseURL, retries=Retries, backoff=Backoff, timeout=Timeout):
+    url = breadcrumb_url(vehicleID, base_url)
+    for attempt in range(retries + 1):
+        try:
+            return json.loads(get(url, timeout))
+        except urllib.error.HTTPError as err:
+            # client errors such as 404 will not succeed on a retry
+            if err.code < 500 and err.code != 429 or attempt == retries:
+                print(f"HTTPError for vehicle {vehicleID}: {err.code} - {err.reason}")
+                return []
+        except urllib.error.URLError as err:
+            if attempt == retries:
+                print(f"URLError for vehicle {vehicleID}: {err.reason}")
+                return []
+        except Exception as err:
+            print(f"Unexpected error for vehicle {vehicleID}: {err}")
+            return []
+        time.sleep(backoff * 2 ** attempt * (1 + random.random()))
+    return []
+
+
+# fetch many vehicles on a thread pool of the given size,
+# yielding (vehicleID, records) as each response arrives
+def fetch_concurrent(vehicle_ids, workers=8, base_url=BaseURL, retries=Retries,
+                     backoff=Backoff, timeout=Timeout):
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(fetch_with_retry, vid, base_url, retries, backoff, timeout): vid
+            for vid in vehicle_ids
+        }
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
+def initialize():
+    global BaseURL, Outfile, VehicleIDs, Workers, Retries
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-v", "--vehicles", type=int, nargs="+", default=VehicleIDs)
+    parser.add_argument("-o", "--outfile", default=Outfile)
+    parser.add_argument("-u", "--url", default=BaseURL, help="getBreadCrumbs endpoint")
+    parser.add_argument("-w", "--workers", type=int,
+                        help="fetch concurrently with this many connections")
+    parser.add_argument("-r", "--retries", type=int, default=Retries)
+    args = parser.parse_args()
+
+    BaseURL = args.url
+    Outfile = args.outfile
+    VehicleIDs = args.vehicles
+    Workers = args.workers
+    Retries = args.retries
+
+
+# yield (vehicleID, records) serially or on a thread pool
+def fetch_all(vehicle_ids):
+    if Workers:
+        yield from fetch_concurrent(vehicle_ids, Workers, BaseURL, Retries)
+    else:
+        for vid in vehicle_ids:
+            yield vid, fetchData(vid, BaseURL)
+
+
+def main():
+    initialize()
+
+    start = time.perf_counter()
+    if is_ndjson(Outfile):
+        # write each vehicle's records as soon as its response arrives
+        count = 0
+        with open_text(Outfile, "w") as file:
+            for vid, vehicle_data in fetch_all(VehicleIDs):
+                count += write_records(file, vehicle_data)
+    else:
+        combined_data = []
+        for vid, vehicle_data in fetch_all(VehicleIDs):
+            combined_data.extend(vehicle_data)
+        count = len(combined_data)
 
-vehicle_ids = [2907, 3055]
-combined_data = []
+        with open(Outfile, 'w') as file:
+            json.dump(combined_data, file, indent=2)
+    elapsed = time.perf_counter() - start
+    print(f"Fetched {count} breadcrumbs for {len(VehicleIDs)} vehicles in {elapsed:0.4f} seconds")
 
-for vid in vehicle_ids:
-    vehicle_data = fetchData(vid)
-    combined_data.extend(vehicle_data)  
 
-with open("bcsample.json", 'w') as file:
-    json.dump(combined_data, file, indent=2)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+# lands decoded breadcrumb records in Postgres with COPY, one micro-batch at a time.
+# Messages are acked only after the batch holding their records has committed,
+# so a crash before commit means redelivery (at-least-once), never loss.
+
+import io
+import csv
+import time
+import queue
+import psycopg2
+from datetime import datetime
+from functools import lru_cache
+
+DBname = "postgres"
+DBuser = "postgres"
+DBpwd = "password"   # insert your postgres db password here
+TableName = 'breadcrumb'
+
+BatchRows = 10000  # flush once this many records are waiting
+FlushInterval = 1.0  # or once the oldest waiting record is this many seconds old
+
+COLUMNS = ["EVENT_NO_TRIP", "EVENT_NO_STOP", "OPD_DATE", "VEHICLE_ID", "METERS",
+           "ACT_TIME", "GPS_LONGITUDE", "GPS_LATITUDE", "GPS_SATELLITES", "GPS_HDOP"]
+
+
+# connect to the database, batches are committed explicitly
+def dbconnect():
+    connection = psycopg2.connect(
+        host="localhost",
+        database=DBname,
+        user=DBuser,
+        password=DBpwd,
+    )
+    connection.autocommit = False
+    return connection
+
+
+# create the breadcrumb table if it does not exist yet
+def createTable(conn):
+    with conn.cursor() as cursor:
+        cursor.execute(f"""
+                CREATE TABLE IF NOT EXISTS {TableName} (
+                        EVENT_NO_TRIP       BIGINT,
+                        EVENT_NO_STOP       BIGINT,
+                        OPD_DATE            DATE,
+                        VEHICLE_ID          INTEGER,
+                        METERS              INTEGER,
+                        ACT_TIME            INTEGER,
+                        GPS_LONGITUDE       DOUBLE PRECISION,
+                        GPS_LATITUDE        DOUBLE PRECISION,
+                        GPS_SATELLITES      REAL,
+                        GPS_HDOP            REAL
+                );
+        """)
+    conn.commit()
+
+
+@lru_cache(maxsize=1024)
+def opd_date_to_iso(opd_date):
+    return datetime.strptime(opd_date, "%d%b%Y:%H:%M:%S").date().isoformat()
+
+
+# COPY records into the table and commit, returning the number of rows written
+def copy_records(conn, records):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for record in records:
+        row = [record.get(name) for name in COLUMNS]
+        if row[2] is not None:
+            row[2] = opd_date_to_iso(row[2])
+        writer.writerow(row)
+    buf.seek(0)
+
+    with conn.cursor() as cursor:
+        cursor.copy_expert(f"COPY {TableName} ({', '.join(COLUMNS)}) FROM STDIN WITH (FORMAT csv, NULL '')", buf)
+    conn.commit()
+    return len(records)
+
+
+# COPY one batch, then ack its messages; on failure roll back and nack them for redelivery.
+# on_flush(messages, records, elapsed, committed) is called once the messages are settled.
+# If the connection itself is gone the error is raised after nacking, as no later batch
+# could be written either.
+def flush(conn, messages, records, on_flush=None):
+    start = time.perf_counter()
+    error = None
+    try:
+        copy_records(conn, records)
+    except psycopg2.Error as err:
+        error = err
+        print(f"COPY of {len(records)} records failed, nacking {len(messages)} messages: {err}")
+        try:
+            conn.rollback()
+        except psycopg2.Error as rollback_err:
+            print(f"Rollback failed: {rollback_err}")
+    committed = error is None
+
+    for message in messages:
+        if committed:
+            message.ack()
+        else:
+            message.nack()
+    if on_flush:
+        on_flush(messages, len(records), time.perf_counter() - start, committed)
+    if error is not None and conn.closed:
+        raise error
+
+
+# consume (message, records) items from work_queue until stop is set and the queue
+# is drained, flushing whenever BatchRows records are waiting or FlushInterval passes.
+# Raises if the connection is lost; items still queued are left for the caller
+def write_batches(conn, work_queue, stop, batch_rows=BatchRows, flush_interval=FlushInterval,
+                  on_flush=None):
+    messages = []
+    records = []
+    deadline = None
+    while not (stop.is_set() and work_queue.empty()):
+        wait = flush_interval if deadline is None else max(0.0, deadline - time.monotonic())
+        try:
+            message, message_records = work_queue.get(timeout=wait)
+            messages.append(message)
+            records.extend(message_records)
+            if deadline is None:
+                deadline = time.monotonic() + flush_interval
+        except queue.Empty:
+            pass
+
+        if messages and (len(records) >= batch_rows or time.monotonic() >= deadline):
+            flush(conn, messages, records, on_flush)
+            messages = []
+            records = []
+            deadline = None
+
+    if messages:
+        flush(conn, messages, records, on_flush)
@@ -1,20 +1,178 @@
-import json
+# this program publishes breadcrumb records to a Pub/Sub topic
+# run it with -h to see the command line options
+# set PUBSUB_EMULATOR_HOST (or pass -e host:port) to publish to a local Pub/Sub emulator
+
+import os
+import time
+import argparse
+import threading
 from google.cloud import pubsub_v1
+from google.api_core.exceptions import AlreadyExists
+from breadcrumb_codec import CODECS, encode, pack_records
+from breadcrumb_io import read_records
+from transport_metrics import Metrics, PUBLISH_TS_ATTRIBUTE, serve_metrics, start_reporter
 
 project_id = "labs-data-engineering-457205"
 topic_id = "MyTopic"
-topic_path = pubsub_v1.PublisherClient().topic_path(project_id, topic_id)
 
-publisher = pubsub_v1.PublisherClient()
+# bcsample.json or a streamed NDJSON file such as bcsample.ndjson.gz
+datafile = "bcsample.json"
+
+# batching: a batch is sent once any of these limits is reached
+MaxMessages = 100
+MaxBytes = 1024 * 1024
+MaxLatency = 0.01  # seconds
+# flow control: publish() blocks while this much data is waiting to be sent
+FlowBytes = 64 * 1024 * 1024
+FlowMessages = 10000
+Pack = 1  # breadcrumbs packed into each message
+Codec = "json"  # message encoding, see breadcrumb_codec.py
+ReportInterval = 10.0  # seconds between metric summary lines, 0 disables them
+MetricsPort = None  # serve Prometheus metrics on this port
+
+
+# counts published and failed messages as their futures complete
+class PublishStats:
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.outstanding = 0
+        self.last_error = None
+
+        self.metrics = Metrics("publisher")
+        self.messages = self.metrics.counter("messages_published", "Messages confirmed by Pub/Sub")
+        self.records = self.metrics.counter("records_published", "Breadcrumbs in confirmed messages")
+        self.bytes = self.metrics.counter("bytes_published", "Payload bytes in confirmed messages")
+        self.failures = self.metrics.counter("publish_failures", "Messages whose publish failed")
+        self.outstanding_messages = self.metrics.gauge("outstanding_messages", "Messages awaiting confirmation")
+        self.outstanding_bytes = self.metrics.gauge("outstanding_bytes", "Payload bytes awaiting confirmation")
+        self.latency = self.metrics.histogram("publish_latency_seconds", "Time from publish() to confirmation")
+
+    def track(self, future, records, size):
+        start = time.perf_counter()
+        with self.cond:
+            self.outstanding += 1
+        self.outstanding_messages.inc()
+        self.outstanding_bytes.inc(size)
+        future.add_done_callback(lambda f: self.done(f, records, size, start))
+
+    def done(self, future, records, size, start):
+        error = future.exception()
+        self.outstanding_messages.dec()
+        self.outstanding_bytes.dec(size)
+        if error is None:
+            self.latency.observe(time.perf_counter() - start)
+            self.messages.inc()
+            self.records.inc(records)
+            self.bytes.inc(size)
+        else:
+            self.failures.inc()
+            self.last_error = error
+
+        with self.cond:
+            self.outstanding -= 1
+            self.cond.notify_all()
+
+    # block until every tracked future has completed
+    def wait(self):
+        with self.cond:
+            self.cond.wait_for(lambda: self.outstanding == 0)
+
+
+def make_publisher():
+    batch_settings = pubsub_v1.types.BatchSettings(
+        max_messages=MaxMessages,
+        max_bytes=MaxBytes,
+        max_latency=MaxLatency,
+    )
+    flow_control = pubsub_v1.types.PublishFlowControl(
+        message_limit=FlowMessages,
+        byte_limit=FlowBytes,
+        limit_exceeded_behavior=pubsub_v1.types.LimitExceededBehavior.BLOCK,
+    )
+    publisher_options = pubsub_v1.types.PublisherOptions(flow_control=flow_control)
+    return pubsub_v1.PublisherClient(batch_settings, publisher_options)
+
+
+# publish every record, pack records per message in the given codec,
+# and wait until all messages are confirmed or failed
+def publish_all(publisher, topic_path, records, pack=1, codec="json", stats=None):
+    if stats is None:
+        stats = PublishStats()
+    for batch in pack_records(records, pack):
+        data, attributes = encode(batch, codec)
+        attributes[PUBLISH_TS_ATTRIBUTE] = f"{time.time():.6f}"
+        future = publisher.publish(topic_path, data, **attributes)
+        stats.track(future, len(batch), len(data))
+
+    stats.wait()
+    return stats
+
+
+def initialize():
+    global datafile, MaxMessages, MaxBytes, MaxLatency, FlowBytes, FlowMessages, Pack, Codec
+    global ReportInterval, MetricsPort
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", "--datafile", default=datafile)
+    parser.add_argument("-e", "--emulator", help="host:port of a Pub/Sub emulator")
+    parser.add_argument("--max-messages", type=int, default=MaxMessages)
+    parser.add_argument("--max-bytes", type=int, default=MaxBytes)
+    parser.add_argument("--max-latency", type=float, default=MaxLatency)
+    parser.add_argument("--flow-bytes", type=int, default=FlowBytes)
+    parser.add_argument("--flow-messages", type=int, default=FlowMessages)
+    parser.add_argument("-p", "--pack", type=int, default=Pack,
+                        help="number of breadcrumbs packed into each message")
+    parser.add_argument("-c", "--codec", choices=sorted(CODECS), default=Codec)
+    parser.add_argument("-i", "--report-interval", type=float, default=ReportInterval,
+                        help="seconds between metric summary lines, 0 disables them")
+    parser.add_argument("-m", "--metrics-port", type=int,
+                        help="serve Prometheus metrics on this port")
+    args = parser.parse_args()
+
+    if args.emulator:
+        os.environ["PUBSUB_EMULATOR_HOST"] = args.emulator
+    datafile = args.datafile
+    MaxMessages = args.max_messages
+    MaxBytes = args.max_bytes
+    MaxLatency = args.max_latency
+    FlowBytes = args.flow_bytes
+    FlowMessages = args.flow_messages
+    Pack = args.pack
+    Codec = args.codec
+    ReportInterval = args.report_interval
+    MetricsPort = args.metrics_port
+
+
+def main():
+    initialize()
+
+    publisher = make_publisher()
+    topic_path = publisher.topic_path(project_id, topic_id)
+
+    # the emulator starts empty, so create the topic there
+    if os.environ.get("PUBSUB_EMULATOR_HOST"):
+        try:
+            publisher.create_topic(name=topic_path)
+        except AlreadyExists:
+            pass
+
+    stats = PublishStats()
+    if ReportInterval:
+        start_reporter(stats.metrics, ReportInterval)
+    if MetricsPort:
+        serve_metrics(stats.metrics, MetricsPort)
+
+    start = time.perf_counter()
+    publish_all(publisher, topic_path, read_records(datafile), Pack, Codec, stats)
+    elapsed = time.perf_counter() - start
 
-with open("bcsample.json", "r") as f:
-    breadcrumb_data = json.load(f)  
+    print(f"Published {stats.records.value} breadcrumbs in {stats.messages.value} messages "
+          f"({stats.bytes.value} bytes) to {topic_path}.")
+    print(f"Elapsed Time: {elapsed:0.4f} seconds, {stats.messages.value / elapsed:0.0f} messages/sec")
+    print(stats.metrics.summary())
+    if stats.failures.value:
+        print(f"Failed to publish {stats.failures.value} messages, last error: {stats.last_error}")
 
-count = 0
-for record in breadcrumb_data:
-    count+=1
-    data_str = json.dumps(record)  
-    data = data_str.encode("utf-8")  
-    future = publisher.publish(topic_path, data)
 
-print(f"Published {len(breadcrumb_data)} messages to {topic_path}.")
+if __name__ == "__main__":
+    main()
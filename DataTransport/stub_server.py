@@ -0,0 +1,71 @@
+# this program serves getBreadCrumbs responses from a local breadcrumb file
+# so fetch.py can be tested without the real API, e.g.
+#   python stub_server.py -p 8000 --delay 0.2 --fail-rate 0.1
+#   python fetch.py -u http://localhost:8000/api/getBreadCrumbs -w 16 -v 2907 3055
+# run it with -h to see the command line options
+
+import argparse
+import json
+import random
+import time
+import urllib.parse
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def load_breadcrumbs(fname):
+    with open(fname, "r") as f:
+        records = json.load(f)
+
+    by_vehicle = defaultdict(list)
+    for record in records:
+        by_vehicle[str(record["VEHICLE_ID"])].append(record)
+    return {vid: json.dumps(rows).encode("utf-8") for vid, rows in by_vehicle.items()}
+
+
+def make_handler(responses, delay, fail_rate):
+    class BreadCrumbHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep connections alive between requests
+
+        def do_GET(self):
+            url = urllib.parse.urlsplit(self.path)
+            vid = urllib.parse.parse_qs(url.query).get("vehicle_id", [""])[0]
+            time.sleep(delay)
+
+            if not url.path.endswith("/getBreadCrumbs"):
+                self.reply(404, b"[]")
+            elif random.random() < fail_rate:
+                self.reply(503, b"[]")
+            else:
+                self.reply(200, responses.get(vid, b"[]"))
+
+        def reply(self, status, body):
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return BreadCrumbHandler
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", "--datafile", default="bcsample.json")
+    parser.add_argument("-p", "--port", type=int, default=8000)
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds to wait per request")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    args = parser.parse_args()
+
+    responses = load_breadcrumbs(args.datafile)
+    server = ThreadingHTTPServer(("localhost", args.port),
+                                 make_handler(responses, args.delay, args.fail_rate))
+    print(f"Serving {len(responses)} vehicles on http://localhost:{args.port}/api/getBreadCrumbs")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
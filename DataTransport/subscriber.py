@@ -1,38 +1,288 @@
-from concurrent.futures import TimeoutError
-from google.cloud import pubsub_v1
+# this program receives breadcrumb messages from a Pub/Sub subscription and,
+# with -l, lands them in Postgres in micro-batches (see pg_sink.py)
+# run it with -h to see the command line options
+# set PUBSUB_EMULATOR_HOST (or pass -e host:port) to use a local Pub/Sub emulator
 
-# TODO(developer)
+import os
+import queue
+import argparse
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import TimeoutError, ThreadPoolExecutor
+from google.cloud import pubsub_v1
+from google.api_core.exceptions import AlreadyExists
+from breadcrumb_codec import decode_message
+from transport_metrics import Metrics, publish_age, serve_metrics, start_reporter
+import pg_sink
 
 project_id = "labs-data-engineering-457205"
+topic_id = "MyTopic"
 subscription_id = "MySub"
 # Number of seconds the subscriber should listen for messages
 timeout = 200.0
-message_count = 0
-
-
-subscriber = pubsub_v1.SubscriberClient()
-# The `subscription_path` method creates a fully qualified identifier
-# in the form `projects/{project_id}/subscriptions/{subscription_id}`
-subscription_path = subscriber.subscription_path(project_id, subscription_id)
-
-def callback(message: pubsub_v1.subscriber.message.Message) -> None:
-    global message_count
-    message_count += 1
-    if(message_count % 10000 == 0):
-        print(f"Received {message}.")
-    message.ack()
-
-streaming_pull_future = subscriber.subscribe(subscription_path, callback=callback)
-print(f"Listening for messages on {subscription_path}..\n")
-
-# Wrap subscriber in a 'with' block to automatically call close() when done.
-with subscriber:
-    try:
-        # When `timeout` is not set, result() will block indefinitely,
-        # unless an exception is encountered first.
-        streaming_pull_future.result(timeout=timeout)
-    except TimeoutError:
-        streaming_pull_future.cancel()  # Trigger the shutdown.
+
+Load = False  # land records in Postgres instead of only counting them
+MaxMessages = 5000  # flow control: messages leased but not yet acked
+MaxBytes = 100 * 1024 * 1024
+CallbackThreads = 10
+ReportInterval = 10.0  # seconds between metric summary lines, 0 disables them
+MetricsPort = None  # serve Prometheus metrics on this port
+
+
+# message/record metrics shared by the callback threads and the writer
+class SubscribeStats:
+    def __init__(self, recent_ids=100000):
+        self.lock = threading.Lock()
+        self.seen = OrderedDict()  # recently received message ids, to spot redeliveries
+        self.recent_ids = recent_ids
+
+        self.metrics = Metrics("subscriber")
+        self.messages = self.metrics.counter("messages_received", "Messages delivered to the callback")
+        self.records = self.metrics.counter("records_received", "Breadcrumbs in delivered messages")
+        self.redeliveries = self.metrics.counter("redeliveries", "Messages delivered more than once")
+        self.acked = self.metrics.counter("messages_acked", "Messages acked")
+        self.nacked = self.metrics.counter("messages_nacked", "Messages nacked for redelivery")
+        self.written = self.metrics.counter("records_written", "Breadcrumbs committed to Postgres")
+        self.batches = self.metrics.counter("batches_written", "Batches committed to Postgres")
+        self.outstanding_messages = self.metrics.gauge("outstanding_messages", "Messages received but not yet acked")
+        self.outstanding_bytes = self.metrics.gauge("outstanding_bytes", "Payload bytes received but not yet acked")
+        self.callback_time = self.metrics.histogram("callback_seconds", "Time spent in the message callback")
+        self.flush_time = self.metrics.histogram("flush_seconds", "Time to COPY and commit a batch")
+        self.ack_latency = self.metrics.histogram("publish_to_ack_seconds", "Time from publish to ack")
+
+    def received(self, message, records):
+        with self.lock:
+            redelivered = message.message_id in self.seen
+            self.seen[message.message_id] = True
+            if len(self.seen) > self.recent_ids:
+                self.seen.popitem(last=False)
+        if redelivered or (message.delivery_attempt or 0) > 1:
+            self.redeliveries.inc()
+
+        self.messages.inc()
+        self.records.inc(records)
+        self.outstanding_messages.inc()
+        self.outstanding_bytes.inc(message.size)
+        if self.messages.value % 10000 == 0:
+            print(f"Received {message}.")
+
+    # record messages that were acked (or nacked when committed is False)
+    def settled(self, messages, committed=True):
+        for message in messages:
+            self.outstanding_messages.dec()
+            self.outstanding_bytes.dec(message.size)
+            if committed:
+                self.acked.inc()
+                self.ack_latency.observe(publish_age(message))
+            else:
+                self.nacked.inc()
+
+    def flushed(self, messages, records, elapsed, committed):
+        self.settled(messages, committed)
+        if committed:
+            self.batches.inc()
+            self.written.inc(records)
+            self.flush_time.observe(elapsed)
+
+
+# hands messages from the callbacks to the writer until close(), which then waits
+# for the callbacks still handing one over; later messages are refused
+class Intake:
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.open = True
+        self.active = 0
+
+    def enter(self):
+        with self.condition:
+            if not self.open:
+                return False
+            self.active += 1
+            return True
+
+    def leave(self):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify_all()
+
+    def close(self):
+        with self.condition:
+            self.open = False
+            self.condition.wait_for(lambda: self.active == 0)
+
+
+def initialize():
+    global timeout, Load, MaxMessages, MaxBytes, CallbackThreads, ReportInterval, MetricsPort
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-t", "--timeout", type=float, default=timeout,
+                        help="seconds to listen for messages")
+    parser.add_argument("-e", "--emulator", help="host:port of a Pub/Sub emulator")
+    parser.add_argument("-l", "--load", action="store_true",
+                        help="COPY received breadcrumbs into Postgres, acking after commit")
+    parser.add_argument("-b", "--batch-rows", type=int,
+                        help=f"flush once this many records are waiting (default "
+                             f"{pg_sink.BatchRows}, at most --max-messages)")
+    parser.add_argument("-f", "--flush-interval", type=float, default=pg_sink.FlushInterval)
+    parser.add_argument("--max-messages", type=int, default=MaxMessages)
+    parser.add_argument("--max-bytes", type=int, default=MaxBytes)
+    parser.add_argument("--threads", type=int, default=CallbackThreads,
+                        help="callback threads")
+    parser.add_argument("-i", "--report-interval", type=float, default=ReportInterval,
+                        help="seconds between metric summary lines, 0 disables them")
+    parser.add_argument("-m", "--metrics-port", type=int,
+                        help="serve Prometheus metrics on this port")
+    args = parser.parse_args()
+
+    if args.emulator:
+        os.environ["PUBSUB_EMULATOR_HOST"] = args.emulator
+    timeout = args.timeout
+    Load = args.load
+    # at most max_messages messages (of at least one record each) can be waiting, so a
+    # larger default batch would never fill and every flush would wait for the timer
+    if args.batch_rows is None:
+        pg_sink.BatchRows = min(pg_sink.BatchRows, args.max_messages)
+    else:
+        pg_sink.BatchRows = args.batch_rows
+        if args.batch_rows > args.max_messages:
+            print(f"Batches of {args.batch_rows} records only fill if messages carry several "
+                  f"records, at most {args.max_messages} messages are leased at a time")
+    pg_sink.FlushInterval = args.flush_interval
+    MaxMessages = args.max_messages
+    MaxBytes = args.max_bytes
+    CallbackThreads = args.threads
+    ReportInterval = args.report_interval
+    MetricsPort = args.metrics_port
+
+
+def main():
+    initialize()
+
+    subscriber = pubsub_v1.SubscriberClient()
+    # The `subscription_path` method creates a fully qualified identifier
+    # in the form `projects/{project_id}/subscriptions/{subscription_id}`
+    subscription_path = subscriber.subscription_path(project_id, subscription_id)
+
+    # the emulator starts empty, so create the subscription there
+    if os.environ.get("PUBSUB_EMULATOR_HOST"):
+        topic_path = pubsub_v1.PublisherClient.topic_path(project_id, topic_id)
+        try:
+            subscriber.create_subscription(name=subscription_path, topic=topic_path)
+        except AlreadyExists:
+            pass
+
+    stats = SubscribeStats()
+    stop = threading.Event()
+    writer_done = threading.Event()
+    intake = Intake()
+    writer_errors = []
+    # flow control caps leased messages at MaxMessages, so a queue that size never fills
+    work_queue = queue.Queue(maxsize=MaxMessages)
+
+    if ReportInterval:
+        start_reporter(stats.metrics, ReportInterval)
+    if MetricsPort:
+        serve_metrics(stats.metrics, MetricsPort)
+
+    def callback(message: pubsub_v1.subscriber.message.Message) -> None:
+        start = time.perf_counter()
+        try:
+            records = decode_message(message)
+        except (ValueError, KeyError) as err:
+            print(f"Could not decode message {message.message_id}: {err}")
+            message.nack()
+            return
+
+        stats.received(message, len(records))
+        if Load:
+            # once shutdown has begun, or the writer is gone, nack for redelivery instead
+            queued = False
+            if intake.enter():
+                try:
+                    while not writer_done.is_set():
+                        try:
+                            work_queue.put((message, records), timeout=1.0)
+                            queued = True
+                            break
+                        except queue.Full:
+                            pass
+                finally:
+                    intake.leave()
+            if not queued:
+                message.nack()
+                stats.settled([message], committed=False)
+        else:
+            message.ack()
+            stats.settled([message])
+        stats.callback_time.observe(time.perf_counter() - start)
+
+    flow_control = pubsub_v1.types.FlowControl(max_messages=MaxMessages, max_bytes=MaxBytes)
+    scheduler = pubsub_v1.subscriber.scheduler.ThreadScheduler(
+        ThreadPoolExecutor(max_workers=CallbackThreads))
+    # on shutdown, wait for running callbacks to return
+    streaming_pull_future = subscriber.subscribe(
+        subscription_path, callback=callback, flow_control=flow_control, scheduler=scheduler,
+        await_callbacks_on_shutdown=True)
+    print(f"Listening for messages on {subscription_path}..\n")
+
+    # if the writer dies (its connection is lost), stop pulling messages too
+    def run_writer(conn):
+        try:
+            pg_sink.write_batches(conn, work_queue, stop, pg_sink.BatchRows,
+                                  pg_sink.FlushInterval, stats.flushed)
+        except Exception as err:
+            writer_errors.append(err)
+            print(f"Writer stopped: {err}")
+            streaming_pull_future.cancel()
+        finally:
+            writer_done.set()
+
+    if Load:
+        conn = pg_sink.dbconnect()
+        pg_sink.createTable(conn)
+        writer = threading.Thread(target=run_writer, args=(conn,))
+        writer.start()
+
+    # refuse new messages, let the writer commit and ack what it has, then nack whatever
+    # it left in the queue; anything still unacked is redelivered later
+    def stop_writer():
+        intake.close()
+        stop.set()
+        if Load:
+            writer.join()
+        while True:
+            try:
+                message, records = work_queue.get_nowait()
+            except queue.Empty:
+                break
+            message.nack()
+            stats.settled([message], committed=False)
+
+    # Wrap subscriber in a 'with' block to automatically call close() when done.
+    # The writer is stopped first: acks and nacks only reach Pub/Sub while the stream
+    # is open, so the last batch is settled before the stream is shut down.
+    with subscriber:
+        try:
+            # When `timeout` is not set, result() will block indefinitely,
+            # unless an exception is encountered first.
+            streaming_pull_future.result(timeout=timeout)
+        except TimeoutError:
+            pass
+        finally:
+            stop_writer()
+            streaming_pull_future.cancel()  # Trigger the shutdown.
         streaming_pull_future.result()  # Block until the shutdown is complete.
 
-print(f"\nTotal messages received: {message_count}")
\ No newline at end of file
+    print(f"\nTotal messages received: {stats.messages.value}")
+    print(f"Total breadcrumbs received: {stats.records.value}")
+    if Load:
+        print(f"Total breadcrumbs written to {pg_sink.TableName}: {stats.written.value} "
+              f"in {stats.batches.value} batches")
+    print(stats.metrics.summary())
+    if writer_errors:
+        raise writer_errors[0]
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+# throughput and latency metrics for publisher.py and subscriber.py.
+# Metrics print as a periodic summary line and can be served in the
+# Prometheus text format on /metrics.
+
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# attribute holding the publisher's wall-clock time, used for publish-to-ack latency
+PUBLISH_TS_ATTRIBUTE = "publish_ts"
+
+# latency buckets in seconds
+LATENCY_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0]
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, lock):
+        self.lock = lock
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self, name):
+        return [(name, self.value)]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set(self, value):
+        with self.lock:
+            self.value = value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, lock, buckets=LATENCY_BUCKETS):
+        self.lock = lock
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        with self.lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+
+    # approximate quantile: upper bound of the bucket holding it
+    def quantile(self, q):
+        with self.lock:
+            rank = q * self.count
+            seen = 0
+            for bound, count in zip(self.buckets + [float("inf")], self.counts):
+                seen += count
+                if count and seen >= rank:
+                    return bound
+        return 0.0
+
+    def samples(self, name):
+        with self.lock:
+            rows = []
+            seen = 0
+            for bound, count in zip(self.buckets + [float("inf")], self.counts):
+                seen += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                rows.append((f'{name}_bucket{{le="{le}"}}', seen))
+            rows.append((f"{name}_sum", self.sum))
+            rows.append((f"{name}_count", self.count))
+        return rows
+
+
+# a named set of metrics sharing one lock
+class Metrics:
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self.helps = {}
+        self.last_report = None
+
+    def add(self, name, help, metric):
+        self.metrics[name] = metric
+        self.helps[name] = help
+        return metric
+
+    def counter(self, name, help):
+        return self.add(name, help, Counter(self.lock))
+
+    def gauge(self, name, help):
+        return self.add(name, help, Gauge(self.lock))
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        return self.add(name, help, Histogram(self.lock, buckets))
+
+    # Prometheus text exposition format
+    def render(self):
+        lines = []
+        for name, metric in self.metrics.items():
+            full = f"{self.prefix}_{name}"
+            lines.append(f"# HELP {full} {self.helps[name]}")
+            lines.append(f"# TYPE {full} {metric.kind}")
+            for sample, value in metric.samples(full):
+                lines.append(f"{sample} {value}")
+        return "\n".join(lines) + "\n"
+
+    # one line with counter rates since the previous call, gauges and latency p50/p99
+    def summary(self):
+        now = time.monotonic()
+        previous, since = self.last_report or ({}, None)
+        parts = []
+        current = {}
+        for name, metric in self.metrics.items():
+            if metric.kind == "counter":
+                current[name] = metric.value
+                rate = ""
+                if since is not None and now > since:
+                    rate = f" ({(metric.value - previous.get(name, 0)) / (now - since):0.0f}/s)"
+                parts.append(f"{name}={metric.value}{rate}")
+            elif metric.kind == "gauge":
+                parts.append(f"{name}={metric.value}")
+            elif metric.count:
+                parts.append(f"{name} p50<={metric.quantile(0.5)}s p99<={metric.quantile(0.99)}s")
+        self.last_report = (current, now)
+        return f"[{self.prefix}] " + " ".join(parts)
+
+
+# print metrics.summary() every interval seconds on a daemon thread
+def start_reporter(metrics, interval):
+    def report():
+        while True:
+            time.sleep(interval)
+            print(metrics.summary())
+
+    thread = threading.Thread(target=report, daemon=True)
+    thread.start()
+    return thread
+
+
+# serve metrics.render() on http://localhost:port/metrics from a daemon thread
+def serve_metrics(metrics, port):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = metrics.render().encode("utf-8")
+            self.send_response(200 if self.path == "/metrics" else 404)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# seconds between the publisher's publish_ts attribute and now,
+# falling back to the server-side publish time
+def publish_age(message):
+    stamp = message.attributes.get(PUBLISH_TS_ATTRIBUTE)
+    if stamp is not None:
+        return time.time() - float(stamp)
+    return time.time() - message.publish_time.timestamp()
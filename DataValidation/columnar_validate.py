@@ -0,0 +1,77 @@
+# columnar version of the emp_validate.py checks: each column is read into a numpy
+# array once, the date columns are parsed once into datetime64, and every rule is
+# evaluated as a boolean mask over all rows
+
+import csv
+import numpy as np
+from datetime import datetime
+
+DATE_FORMAT = "%Y-%m-%d"
+MIN_HIRE_DATE = np.datetime64("2015-01-01")
+COLUMNS = ['name', 'birth_date', 'hire_date', 'city', 'salary']
+
+
+# read the csv into {column name: numpy array of strings}, keeping only the
+# columns the rules look at
+def read_columns(file_path, names=COLUMNS):
+    with open(file_path, 'r', encoding='utf-8', newline='') as file:
+        csv_reader = csv.reader(file)
+        header = next(csv_reader)
+        wanted = [(name, header.index(name), []) for name in names]
+        # only the wanted fields of each row are kept as it streams past
+        for row in csv_reader:
+            for name, i, values in wanted:
+                values.append(row[i])
+    return {name: np.array(values, dtype=str) for name, i, values in wanted}
+
+
+# parse YYYY-MM-DD strings into datetime64[D], NaT where strptime would fail.
+# numpy parses a clean column in one call; only the rows it rejects (or partial
+# dates like "2016-05" that numpy accepts) fall back to strptime one at a time
+def parse_dates(values):
+    try:
+        dates = values.astype("datetime64[D]")
+        suspect = np.flatnonzero(np.char.str_len(values) != 10)
+    except ValueError:
+        dates = np.full(len(values), np.datetime64("NaT"), dtype="datetime64[D]")
+        suspect = np.arange(len(values))
+
+    for i in suspect:
+        try:
+            dates[i] = np.datetime64(datetime.strptime(values[i], DATE_FORMAT).date())
+        except ValueError:
+            dates[i] = np.datetime64("NaT")
+    return dates
+
+
+# evaluate every rule, returning {rule: offending row indices}, or the offending
+# cities for lonely_cities as in the rule set, and the salaries.
+# Row indices count data rows from 0, so row i is on line i + 2 of the file
+def validate_columns(columns):
+    birth = parse_dates(columns['birth_date'])
+    hire = parse_dates(columns['hire_date'])
+    # NaT compares False, so unparseable dates count as violations like in the loop
+    null_names = np.char.strip(columns['name']) == ""
+    hired_before_2015 = ~(hire >= MIN_HIRE_DATE)
+    birth_after_hire = ~(birth < hire)
+
+    # cities listed in order of first appearance, as the rule set lists them
+    cities, first_rows, city_counts = np.unique(columns['city'], return_index=True,
+                                                return_counts=True)
+    lonely = city_counts <= 1
+    lonely_cities = cities[lonely][np.argsort(first_rows[lonely])]
+
+    violations = {
+        "null_names": np.flatnonzero(null_names),
+        "hired_before_2015": np.flatnonzero(hired_before_2015),
+        "birth_after_hire": np.flatnonzero(birth_after_hire),
+        "lonely_cities": lonely_cities,
+    }
+    counts = {
+        "null_names": int(null_names.sum()),
+        "hired_before_2015": int(hired_before_2015.sum()),
+        "birth_after_hire": int(birth_after_hire.sum()),
+        "lonely_cities": len(lonely_cities),
+    }
+    salaries = columns['salary'].astype(float)
+    return counts, violations, salaries
@@ -1,9 +1,15 @@
+import os
 import csv
+import glob
+import argparse
 from datetime import datetime
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import matplotlib.pyplot as plt
 import numpy as np
 from scipy import stats
+from columnar_validate import read_columns, validate_columns
+from rule_engine import RuleSet, SharedLimits, ViolationLimitExceeded, parse_date, parse_float
 
 def validate_name(name):
     return bool(name.strip())
@@ -36,6 +42,53 @@ def validate_csv_entries(file_path):
         print(f"An error occurred: {e}")
         return []
 
+# yield rows as they are read instead of holding the whole file
+def stream_csv_entries(file_path):
+    with open(file_path, 'r', encoding='utf-8') as file:
+        yield from csv.DictReader(file)
+
+# csv files named by a path, a directory (its *.csv files) or a glob pattern
+def resolve_csv_paths(pattern):
+    if os.path.isdir(pattern):
+        return sorted(glob.glob(os.path.join(pattern, '*.csv')))
+    if any(c in pattern for c in '*?['):
+        return sorted(glob.glob(pattern))
+    return [pattern]
+
+# split a file (after its header line) into about nshards byte ranges that start
+# and end on line boundaries. Assumes no quoted field spans lines.
+# Copied from split_file in DataStorage/load_inserts.py, the directories share no module
+def split_file(file_path, nshards):
+    size = os.path.getsize(file_path)
+    with open(file_path, 'rb') as file:
+        file.readline()
+        start = file.tell()
+        bounds = [start]
+        for i in range(1, nshards):
+            file.seek(max(start + (size - start) * i // nshards, bounds[-1]))
+            file.readline()
+            if file.tell() < size and file.tell() > bounds[-1]:
+                bounds.append(file.tell())
+        bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+# rows of bytes [start, end) of a file, using the file's header line for the keys
+def shard_csv_entries(file_path, start, end):
+    with open(file_path, 'rb') as file:
+        fieldnames = next(csv.reader([file.readline().decode('utf-8')]))
+        file.seek(start)
+
+        def lines():
+            remaining = end - start
+            while remaining > 0:
+                line = file.readline()
+                if not line:
+                    break
+                remaining -= len(line)
+                yield line.decode('utf-8')
+
+        yield from csv.DictReader(lines(), fieldnames=fieldnames)
+
 def validate_multiple_employees_in_city(city, city_counter):
     return city_counter[city] > 1
 
@@ -48,19 +101,34 @@ def validate_salary_normality(salaries):
     plt.gca().get_xaxis().set_major_formatter(plt.FuncFormatter(lambda x, _: f'{x:,.0f}'))
     plt.show()
 
-csv_file_path = 'employees.csv'
-csv_data = validate_csv_entries(csv_file_path)
+# same histogram from the RunningStats bins of a streamed run
+def plot_salary_summary(summary):
+    edges, counts = summary.histogram()
+    plt.stairs(counts, edges, fill=True, edgecolor='black')
+    plt.title("Histogram of Salaries")
+    plt.xlabel("Salary")
+    plt.ylabel("Frequency")
+    plt.gca().get_xaxis().set_major_formatter(plt.FuncFormatter(lambda x, _: f'{x:,.0f}'))
+    plt.show()
+
+def print_salary_summary(summary):
+    statistic, p_value = summary.jarque_bera()
+    print(f"Salaries: n={summary.n} mean={summary.mean:,.0f} stddev={summary.stddev():,.0f} "
+          f"skewness={summary.skewness():0.3f} excess kurtosis={summary.kurtosis():0.3f}")
+    print(f"Jarque-Bera normality: statistic={statistic:0.1f} p={p_value:0.4g}")
 
-nullNames = 0 
-invalid_hire_dates = 0
-birth_after_hire = 0
-city_employees_violations = 0
-salaries = []
+# run the assertions one row at a time over the validate_csv_entries dicts,
+# returning the violation counts and the salaries
+def validate_rows(csv_data):
+    nullNames = 0
+    invalid_hire_dates = 0
+    birth_after_hire = 0
+    city_employees_violations = 0
+    salaries = []
 
-# Track number of employees in each city
-city_counter = Counter()
+    # Track number of employees in each city
+    city_counter = Counter()
 
-if csv_data:
     for row in csv_data:
         # Count the employees in each city
         city_counter[row['city']] += 1
@@ -72,7 +140,7 @@ if csv_data:
             invalid_hire_dates += 1
         if not validate_birth_before_hire(row['birth_date'], row['hire_date']):
             birth_after_hire += 1
-        
+
         # Collect salaries for normality check
         salary = float(row['salary'])
         salaries.append(salary)
@@ -82,14 +150,222 @@ if csv_data:
         if count <= 1:
             city_employees_violations += 1
 
-    # Validate salary normality
-    if salaries:
+    counts = {
+        "null_names": nullNames,
+        "hired_before_2015": invalid_hire_dates,
+        "birth_after_hire": birth_after_hire,
+        "lonely_cities": city_employees_violations,
+    }
+    return counts, salaries
+
+# rule name -> report line
+DESCRIPTIONS = {
+    "null_names": "Number of records with NULL names",
+    "hired_before_2015": "Number of employees hired before 2015",
+    "birth_after_hire": "Number of employees born after or on hire date",
+    "lonely_cities": "Number of cities with fewer than two employees",
+    "unknown_managers": "Number of employees whose reports_to is not an eid",
+}
+
+# the same assertions as a declarative rule set, plus the reports_to reference check.
+# Dates and salary are parsed once per row before any rule sees them
+EMPLOYEE_RULES = RuleSet(types={
+    "birth_date": parse_date,
+    "hire_date": parse_date,
+    "salary": parse_float,
+})
+EMPLOYEE_RULES.add_row("null_names", ["name"], validate_name, DESCRIPTIONS["null_names"])
+
+@EMPLOYEE_RULES.row("hired_before_2015", ["hire_date"], DESCRIPTIONS["hired_before_2015"])
+def hired_since_2015(hire):
+    return hire is not None and hire.year >= 2015
+
+@EMPLOYEE_RULES.row("birth_after_hire", ["birth_date", "hire_date"], DESCRIPTIONS["birth_after_hire"])
+def born_before_hire(birth, hire):
+    return birth is not None and hire is not None and birth < hire
+
+EMPLOYEE_RULES.add_count("lonely_cities", "city", lambda count: count > 1,
+                         DESCRIPTIONS["lonely_cities"])
+EMPLOYEE_RULES.add_reference("unknown_managers", "reports_to", "eid",
+                             DESCRIPTIONS["unknown_managers"])
+
+def print_counts(counts):
+    for name, count in counts.items():
+        print(f"{DESCRIPTIONS.get(name, name)}: {count}")
+
+# print up to limit offending row indices (or values, for aggregate rules) per rule
+def print_violations(violations, limit=10):
+    for rule, found in violations.items():
+        if len(found):
+            more = f" ... ({len(found) - limit} more)" if len(found) > limit else ""
+            print(f"{rule}: {', '.join(str(i) for i in found[:limit])}{more}")
+
+# validate the file row by row as it is read, aborting early on a limit
+def stream_validate(file_path, limits, max_violations, keep, plot):
+    try:
+        counts, violations, summaries = EMPLOYEE_RULES.validate(
+            stream_csv_entries(file_path), summarize=["salary"], keep=keep,
+            limits=limits, max_violations=max_violations)
+    except FileNotFoundError:
+        print(f"Error: File not found at '{file_path}'")
+        return
+    except ViolationLimitExceeded as stop:
+        print(f"Stopped: {stop}")
+        print_counts(stop.counts)
+        print_violations(stop.violations)
+        return
+    print_summary(counts, violations, summaries["salary"], plot)
+
+# violation counts shared by the pool's workers, set by init_shard in each of them
+SharedCounts = None
+
+def init_shard(shared):
+    global SharedCounts
+    SharedCounts = shared
+
+# process pool task: scan one byte range of one file with EMPLOYEE_RULES
+def scan_shard(task):
+    file_path, start, end, keep = task
+    return EMPLOYEE_RULES.scan(shard_csv_entries(file_path, start, end), summarize=["salary"],
+                               keep=keep, shared=SharedCounts)
+
+# scan every file, each split into nshards byte ranges, across a process pool, then
+# merge the shards in file order and evaluate the cross-shard rules (city counts,
+# reports_to) once over the merged indexes. Limits apply to the violations of all
+# shards together: the workers count them into shared memory, and once one shard
+# passes a limit the running shards stop and the queued ones are dropped.
+def parallel_validate(file_paths, nshards, workers, limits, max_violations, keep, plot):
+    missing = [path for path in file_paths if not os.path.isfile(path)]
+    if not file_paths or missing:
+        print(f"Error: File not found at '{missing[0] if missing else file_paths}'")
+        return
+
+    tasks = [(path, start, end, keep)
+             for path in file_paths for start, end in split_file(path, nshards)]
+    shared = None
+    if limits or max_violations is not None:
+        shared = SharedLimits([name for name, columns, check in EMPLOYEE_RULES.row_rules],
+                              limits, max_violations)
+    rows = 0
+    stopped = False
+    results = {}
+
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=init_shard,
+                                   initargs=(shared,))
+    futures = {executor.submit(scan_shard, task): i for i, task in enumerate(tasks)}
+    for future in as_completed(futures):
+        try:
+            results[futures[future]] = future.result()
+        except ViolationLimitExceeded:
+            stopped = True
+            break
+    # on a stop the running shards end within a few rows; queued ones never start
+    executor.shutdown(cancel_futures=stopped)
+    for future in futures:
+        if future.cancelled():
+            continue
+        try:
+            rows += future.result().rows
+        except ViolationLimitExceeded as stop:
+            rows += stop.rows_read
+    if stopped:
+        print(f"Stopped: violation limit passed at {shared.passed_rule()} after {rows} rows")
+        print_counts(shared.totals())
+        return
+
+    label_rows = len(file_paths) > 1
+    merged = EMPLOYEE_RULES.start(summarize=["salary"])
+    offsets = Counter()  # rows already merged per file, to number rows within each file
+    for i, task in enumerate(tasks):
+        path = task[0]
+        merged.merge(results[i], offset=offsets[path], label=path if label_rows else None,
+                     keep=keep)
+        offsets[path] += results[i].rows
+
+    print(f"Validated {merged.rows} rows from {len(file_paths)} files in {len(tasks)} shards")
+    counts, violations, summaries = EMPLOYEE_RULES.finish(merged)
+    print_summary(counts, violations, summaries["salary"], plot)
+
+def print_summary(counts, violations, salaries, plot):
+    if salaries.n == 0:
+        print("No data to display.")
+    else:
+        print_salary_summary(salaries)
+        if plot:
+            plot_salary_summary(salaries)
+    print_counts(counts)
+    print_violations(violations)
+
+csv_file_path = 'employees.csv'
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-f", "--file", default=csv_file_path,
+                        help="csv file; with -p also a directory or glob of files")
+    parser.add_argument("-c", "--columnar", action="store_true",
+                        help="evaluate the rules as numpy masks and list offending rows")
+    parser.add_argument("-r", "--rules", action="store_true",
+                        help="evaluate EMPLOYEE_RULES in one pass, including reports_to")
+    parser.add_argument("-s", "--stream", action="store_true",
+                        help="run EMPLOYEE_RULES on rows as they are read, in constant memory")
+    parser.add_argument("-p", "--parallel", action="store_true",
+                        help="stream every file matched by -f through a process pool")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count(),
+                        help="with -p, worker processes")
+    parser.add_argument("--shards", type=int, default=1,
+                        help="with -p, byte ranges each file is split into")
+    parser.add_argument("--fail-after", type=int,
+                        help="with -s/-p, stop once more than this many row violations are found "
+                             "(over all files and shards)")
+    parser.add_argument("--limit", action="append", default=[], metavar="RULE=N",
+                        help="with -s/-p, stop once RULE has more than N violations over all "
+                             "files and shards (repeatable)")
+    parser.add_argument("--keep", type=int, default=100,
+                        help="with -s/-p, offending row indices kept per rule")
+    parser.add_argument("-n", "--no-plot", action="store_true",
+                        help="skip the salary histogram")
+    args = parser.parse_args()
+
+    limits = {}
+    row_rules = [rule[0] for rule in EMPLOYEE_RULES.row_rules]
+    for limit in args.limit:
+        rule, _, n = limit.partition("=")
+        if rule not in row_rules or not n.isdigit():
+            parser.error(f"--limit expects RULE=N with RULE one of {', '.join(row_rules)}")
+        limits[rule] = int(n)
+
+    if args.stream:
+        stream_validate(args.file, limits, args.fail_after, args.keep, not args.no_plot)
+        return
+    if args.parallel:
+        parallel_validate(resolve_csv_paths(args.file), args.shards, args.workers, limits,
+                          args.fail_after, args.keep, not args.no_plot)
+        return
+
+    if args.columnar:
+        try:
+            columns = read_columns(args.file)
+        except FileNotFoundError:
+            print(f"Error: File not found at '{args.file}'")
+            return
+        counts, violations, salaries = validate_columns(columns)
+    elif args.rules:
+        csv_data = validate_csv_entries(args.file)
+        counts, violations, collected = EMPLOYEE_RULES.validate(csv_data, collect=["salary"])
+        salaries = collected["salary"]
+    else:
+        csv_data = validate_csv_entries(args.file)
+        counts, salaries = validate_rows(csv_data)
+        violations = {}
+
+    if len(salaries) == 0:
+        print("No data to display.")
+    elif not args.no_plot:
+        # Validate salary normality
         validate_salary_normality(salaries)
 
-else:
-    print("No data to display.")
+    print_counts(counts)
+    print_violations(violations)
 
-print(f"Number of records with NULL names: {nullNames}")
-print(f"Number of employees hired before 2015: {invalid_hire_dates}")
-print(f"Number of employees born after or on hire date: {birth_after_hire}")
-print(f"Number of cities with fewer than two employees: {city_employees_violations}")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+# declarative validation rules evaluated in a single pass over csv row dicts.
+# A RuleSet holds three kinds of rules:
+#   row rules       check(values...) -> bool on one or more columns of a row
+#   count rules     check(count) -> bool on the number of rows sharing a column value
+#   reference rules every value of a column must appear in another column
+# Typed columns are parsed once per row however many rules use them, and count and
+# reference rules share one hash index per column, built during the same pass.
+# scan() returns a ScanResult that can be merged with those of other shards of the
+# data before finish() evaluates the count and reference rules over all of them.
+
+import multiprocessing
+from array import array
+from datetime import datetime
+from running_stats import RunningStats
+
+
+# None for values that do not parse, so rules can treat them as violations
+def parse_date(value, date_format="%Y-%m-%d"):
+    try:
+        return datetime.strptime(value, date_format)
+    except ValueError:
+        return None
+
+
+def parse_float(value):
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+# row rule violations passed a limit given to RuleSet.validate; carries what
+# had been found up to that row
+class ViolationLimitExceeded(Exception):
+    def __init__(self, rule, rows_read, counts, violations):
+        # every argument goes to Exception so it survives pickling out of a worker process
+        super().__init__(rule, rows_read, counts, violations)
+        self.rule = rule
+        self.rows_read = rows_read
+        self.counts = counts
+        self.violations = violations
+
+    def __str__(self):
+        return f"violation limit passed at {self.rule} after {self.rows_read} rows"
+
+
+# row rule violation counts shared by the processes scanning shards of the same rows,
+# so limits apply to all shards together. Hand it to the workers when the pool is
+# created (initializer arguments), not with each task. scan() counts into it, and once
+# any shard passes a limit every other shard stops within STOP_CHECK rows.
+class SharedLimits:
+    STOP_CHECK = 1024
+
+    def __init__(self, names, limits=None, max_violations=None, context=multiprocessing):
+        limits = limits or {}
+        self.names = list(names)
+        self.limits = [limits.get(name) for name in self.names]
+        self.max_violations = max_violations
+        self.counts = context.Array('q', len(self.names) + 1)  # per rule, then the total
+        self.passed = context.Value('i', -1, lock=False)  # rule index, len(names) for the total
+        self.stop = context.Event()
+
+    # count one violation of rule slot, returning True when that passed a limit
+    def add(self, slot):
+        counts = self.counts
+        with counts.get_lock():
+            counts[slot] += 1
+            counts[-1] += 1
+            limit = self.limits[slot]
+            if limit is not None and counts[slot] > limit:
+                passed = slot
+            elif self.max_violations is not None and counts[-1] > self.max_violations:
+                passed = len(self.names)
+            else:
+                return False
+            if not self.stop.is_set():
+                self.passed.value = passed
+                self.stop.set()
+        return True
+
+    # the rule whose limit stopped the scan, "all rules" for max_violations, or None
+    def passed_rule(self):
+        if not self.stop.is_set():
+            return None
+        slot = self.passed.value
+        return self.names[slot] if slot < len(self.names) else "all rules"
+
+    def totals(self):
+        with self.counts.get_lock():
+            return dict(zip(self.names, self.counts[:-1]))
+
+
+# how many rows hold each value of a column: values map to slots in a
+# dict, the counts themselves live in one array instead of int objects
+class ValueCounts:
+    def __init__(self):
+        self.slots = {}
+        self.counts = array('Q')
+
+    def add(self, value):
+        slot = self.slots.get(value)
+        if slot is None:
+            self.slots[value] = len(self.counts)
+            self.counts.append(1)
+        else:
+            self.counts[slot] += 1
+
+    def __getitem__(self, value):
+        slot = self.slots.get(value)
+        return 0 if slot is None else self.counts[slot]
+
+    def __iter__(self):
+        return iter(self.slots)
+
+    def items(self):
+        counts = self.counts
+        return ((value, counts[slot]) for value, slot in self.slots.items())
+
+    def merge(self, other):
+        for value, count in other.items():
+            slot = self.slots.get(value)
+            if slot is None:
+                self.slots[value] = len(self.counts)
+                self.counts.append(count)
+            else:
+                self.counts[slot] += count
+
+
+# partial state of a RuleSet over one shard of the rows
+class ScanResult:
+    def __init__(self, counts, offenders, indexes, keys, summaries, collected):
+        self.rows = 0
+        self.counts = counts  # row rule -> violations
+        self.offenders = offenders  # row rule -> offending row indices, up to keep
+        self.indexes = indexes  # column -> ValueCounts
+        self.keys = keys  # referenced column -> set of values
+        self.summaries = summaries  # column -> RunningStats
+        self.collected = collected  # column -> list of parsed values
+
+    # fold another shard in. Its row indices are shifted by offset and, with label,
+    # recorded as "label:row" so rows from different files stay distinguishable
+    def merge(self, other, offset=0, label=None, keep=None):
+        for name, count in other.counts.items():
+            self.counts[name] += count
+            rows = [i + offset for i in other.offenders[name]]
+            if label is not None:
+                rows = [f"{label}:{i}" for i in rows]
+            room = len(rows) if keep is None else max(0, keep - len(self.offenders[name]))
+            self.offenders[name].extend(rows[:room])
+        for column, index in other.indexes.items():
+            self.indexes[column].merge(index)
+        for column, seen in other.keys.items():
+            self.keys[column] |= seen
+        for column, summary in other.summaries.items():
+            self.summaries[column].merge(summary)
+        for column, values in other.collected.items():
+            self.collected[column].extend(values)
+        self.rows += other.rows
+
+
+class RuleSet:
+    def __init__(self, types=None):
+        self.types = dict(types or {})  # column -> parser applied before the rules run
+        self.row_rules = []  # (name, columns, check)
+        self.count_rules = []  # (name, column, check)
+        self.reference_rules = []  # (name, column, target, allow_empty)
+        self.descriptions = {}
+
+    def add_row(self, name, columns, check, description):
+        self.row_rules.append((name, list(columns), check))
+        self.descriptions[name] = description
+
+    # decorator form of add_row
+    def row(self, name, columns, description):
+        def register(check):
+            self.add_row(name, columns, check, description)
+            return check
+        return register
+
+    def add_count(self, name, column, check, description):
+        self.count_rules.append((name, column, check))
+        self.descriptions[name] = description
+
+    def add_reference(self, name, column, target, description, allow_empty=True):
+        self.reference_rules.append((name, column, target, allow_empty))
+        self.descriptions[name] = description
+
+    # one pass over rows (dicts, as from csv.DictReader), returning
+    # {rule: violation count} and {rule: offending row indices or values}.
+    # Columns in collect are returned as lists of their parsed values and columns in
+    # summarize as RunningStats. keep caps the row indices stored per rule. Row rules
+    # are checked against limits ({rule: n}) and max_violations (all row rules together)
+    # as rows arrive, raising ViolationLimitExceeded as soon as one is passed. With
+    # shared (a SharedLimits) they apply to every scan counting into it instead.
+    def validate(self, rows, collect=(), summarize=(), keep=None, limits=None,
+                 max_violations=None, shared=None):
+        return self.finish(self.scan(rows, collect, summarize, keep, limits, max_violations,
+                                     shared))
+
+    # empty ScanResult for this rule set
+    def start(self, collect=(), summarize=()):
+        counted = {column for name, column, check in self.count_rules}
+        counted |= {column for name, column, target, allow_empty in self.reference_rules}
+        targets = {target for name, column, target, allow_empty in self.reference_rules}
+        return ScanResult(
+            counts={name: 0 for name, columns, check in self.row_rules},
+            offenders={name: [] for name, columns, check in self.row_rules},
+            indexes={column: ValueCounts() for column in counted},
+            keys={column: set() for column in targets},
+            summaries={column: RunningStats() for column in summarize},
+            collected={column: [] for column in collect},
+        )
+
+    # the single pass of validate: row rules are decided here, count and reference
+    # rules only build their indexes
+    def scan(self, rows, collect=(), summarize=(), keep=None, limits=None, max_violations=None,
+             shared=None):
+        result = self.start(collect, summarize)
+        typed = [(column, parser) for column, parser in self.types.items()]
+        limits = limits or {}
+        row_rules = [(name, columns, check, result.offenders[name], limits.get(name), slot)
+                     for slot, (name, columns, check) in enumerate(self.row_rules)]
+        counts = result.counts
+        indexes = result.indexes
+        keys = result.keys
+        collected = result.collected
+        summaries = result.summaries
+        total = 0
+
+        for i, row in enumerate(rows):
+            if shared is not None and i % shared.STOP_CHECK == 0 and shared.stop.is_set():
+                raise ViolationLimitExceeded(shared.passed_rule(), i, counts, result.offenders)
+            values = dict(row)
+            for column, parser in typed:
+                values[column] = parser(row[column])
+
+            for name, columns, check, offenders, limit, slot in row_rules:
+                if not check(*[values[column] for column in columns]):
+                    counts[name] += 1
+                    total += 1
+                    if keep is None or len(offenders) < keep:
+                        offenders.append(i)
+                    if ((limit is not None and counts[name] > limit)
+                            or (max_violations is not None and total > max_violations)):
+                        raise ViolationLimitExceeded(name, i + 1, counts, result.offenders)
+                    if shared is not None and shared.add(slot):
+                        raise ViolationLimitExceeded(shared.passed_rule(), i + 1, counts,
+                                                     result.offenders)
+            for column, index in indexes.items():
+                index.add(row[column])
+            for column, seen in keys.items():
+                seen.add(row[column])
+            for column, out in collected.items():
+                out.append(values[column])
+            for column, summary in summaries.items():
+                summary.add(values[column])
+            result.rows += 1
+        return result
+
+    # evaluate the count and reference rules over a (merged) ScanResult, returning
+    # the same (counts, violations, collected) as validate
+    def finish(self, result):
+        counts = dict(result.counts)
+        violations = dict(result.offenders)
+        indexes = result.indexes
+        for name, column, check in self.count_rules:
+            failed = [value for value, count in indexes[column].items() if not check(count)]
+            counts[name] = len(failed)
+            violations[name] = failed
+        for name, column, target, allow_empty in self.reference_rules:
+            failed = [value for value in indexes[column]
+                      if value not in result.keys[target] and not (allow_empty and value == "")]
+            counts[name] = sum(indexes[column][value] for value in failed)
+            violations[name] = failed
+        collected = dict(result.collected)
+        collected.update(result.summaries)
+        return counts, violations, collected
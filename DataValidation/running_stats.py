@@ -0,0 +1,134 @@
+# constant-memory summary of a numeric column: a histogram of at most max_bins
+# equal-width bins held in an array plus the first four moments, updated one value
+# at a time, so the salary normality check no longer needs every salary in a list.
+# When a value falls outside what max_bins can cover, the bin width is doubled and
+# neighbouring bins are folded together, so one outlier cannot blow up the array
+
+import math
+from array import array
+from scipy import stats
+
+
+class RunningStats:
+    def __init__(self, bin_width=5000.0, max_bins=1000):
+        self.bin_width = bin_width
+        self.max_bins = max_bins
+        self.first_bin = None  # index of bins[0], bin i covers [i * width, (i + 1) * width)
+        self.bins = array('Q')
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0  # sums of powers of differences from the mean
+        self.m3 = 0.0
+        self.m4 = 0.0
+
+    def add(self, x):
+        # None, NaN and infinities are left out of the summary
+        if x is None or not math.isfinite(x):
+            return
+        self.add_to_histogram(x)
+
+        # one-pass update of the central moments (Terriberry)
+        n1 = self.n
+        self.n += 1
+        delta = x - self.mean
+        delta_n = delta / self.n
+        delta_n2 = delta_n * delta_n
+        term1 = delta * delta_n * n1
+        self.mean += delta_n
+        self.m4 += (term1 * delta_n2 * (self.n * self.n - 3 * self.n + 3)
+                    + 6 * delta_n2 * self.m2 - 4 * delta_n * self.m3)
+        self.m3 += term1 * delta_n * (self.n - 2) - 3 * delta_n * self.m2
+        self.m2 += term1
+
+    def add_to_histogram(self, x):
+        index = math.floor(x / self.bin_width)
+        if self.first_bin is None:
+            self.first_bin = index
+        first = min(index, self.first_bin)
+        last = max(index, self.first_bin + len(self.bins) - 1)
+        while last - first >= self.max_bins:
+            self.coarsen()
+            index, first, last = index // 2, first // 2, last // 2
+        if index < self.first_bin:
+            self.bins[0:0] = array('Q', [0] * (self.first_bin - index))
+            self.first_bin = index
+        offset = index - self.first_bin
+        if offset >= len(self.bins):
+            self.bins.extend([0] * (offset - len(self.bins) + 1))
+        self.bins[offset] += 1
+
+    # double the bin width, folding each pair of bins into one. Bin edges stay at
+    # multiples of the width, so bin i now holds what were bins 2i and 2i + 1
+    def coarsen(self):
+        first = self.first_bin // 2
+        bins = array('Q', [0] * ((self.first_bin + len(self.bins) - 1) // 2 - first + 1))
+        for i, count in enumerate(self.bins):
+            bins[(self.first_bin + i) // 2 - first] += count
+        self.first_bin = first
+        self.bins = bins
+        self.bin_width *= 2
+
+    # fold in the stats of another shard (Pebay's pairwise update for the moments).
+    # The histograms are merged at the coarser of the two bin widths
+    def merge(self, other):
+        if other.n == 0:
+            return
+        if self.n == 0:
+            self.__dict__.update(other.__dict__)
+            self.bins = array('Q', other.bins)
+            return
+        while self.bin_width < other.bin_width:
+            self.coarsen()
+        shift = round(math.log2(self.bin_width / other.bin_width))
+        if other.bin_width * 2 ** shift != self.bin_width:
+            raise ValueError("cannot merge histograms whose bin widths are not a power of two apart")
+
+        # other's bin i falls in bin i >> shift at this width
+        first = min(self.first_bin, other.first_bin >> shift)
+        last = max(self.first_bin + len(self.bins) - 1,
+                   (other.first_bin + len(other.bins) - 1) >> shift)
+        while last - first >= self.max_bins:
+            self.coarsen()
+            shift, first, last = shift + 1, first // 2, last // 2
+        bins = array('Q', [0] * (last - first + 1))
+        for i, count in enumerate(self.bins):
+            bins[self.first_bin + i - first] += count
+        for i, count in enumerate(other.bins):
+            bins[((other.first_bin + i) >> shift) - first] += count
+        self.first_bin = first
+        self.bins = bins
+
+        na, nb = self.n, other.n
+        n = na + nb
+        delta = other.mean - self.mean
+        m2 = self.m2 + other.m2 + delta ** 2 * na * nb / n
+        m3 = (self.m3 + other.m3 + delta ** 3 * na * nb * (na - nb) / n ** 2
+              + 3 * delta * (na * other.m2 - nb * self.m2) / n)
+        m4 = (self.m4 + other.m4 + delta ** 4 * na * nb * (na * na - na * nb + nb * nb) / n ** 3
+              + 6 * delta ** 2 * (na * na * other.m2 + nb * nb * self.m2) / n ** 2
+              + 4 * delta * (na * other.m3 - nb * self.m3) / n)
+        self.n = n
+        self.mean += delta * nb / n
+        self.m2, self.m3, self.m4 = m2, m3, m4
+
+    # bin edges and counts, for plt.stairs
+    def histogram(self):
+        if self.first_bin is None:
+            return [], []
+        edges = [(self.first_bin + i) * self.bin_width for i in range(len(self.bins) + 1)]
+        return edges, list(self.bins)
+
+    def stddev(self):
+        return math.sqrt(self.m2 / self.n) if self.n else 0.0
+
+    def skewness(self):
+        return math.sqrt(self.n) * self.m3 / self.m2 ** 1.5 if self.m2 else 0.0
+
+    # excess kurtosis, 0 for a normal distribution
+    def kurtosis(self):
+        return self.n * self.m4 / (self.m2 * self.m2) - 3.0 if self.m2 else 0.0
+
+    # Jarque-Bera test of normality from the moments: (statistic, p-value)
+    def jarque_bera(self):
+        statistic = self.n / 6.0 * (self.skewness() ** 2 + self.kurtosis() ** 2 / 4.0)
+        return statistic, stats.chi2.sf(statistic, 2)
@@ -0,0 +1,73 @@
+# this program compares the row-at-a-time validation loop against the columnar
+# mode and the single-pass rule set
+# run it with -h to see the command line options
+
+import os
+import csv
+import time
+import argparse
+import tempfile
+from emp_validate import EMPLOYEE_RULES, csv_file_path, validate_csv_entries, validate_rows
+from columnar_validate import read_columns, validate_columns
+
+
+# write a synthetic extract by repeating the sample rows scale times
+def make_data(fname, scale):
+    with open(fname, 'r', encoding='utf-8', newline='') as file:
+        csv_reader = csv.reader(file)
+        header = next(csv_reader)
+        rows = list(csv_reader)
+
+    out = tempfile.NamedTemporaryFile('w', encoding='utf-8', newline='', suffix='.csv', delete=False)
+    with out:
+        csv_writer = csv.writer(out)
+        csv_writer.writerow(header)
+        for i in range(scale):
+            csv_writer.writerows(rows)
+    return out.name, len(rows) * scale
+
+
+def validate_loop(fname):
+    return validate_rows(validate_csv_entries(fname))[0]
+
+
+def validate_columnar(fname):
+    return validate_columns(read_columns(fname))[0]
+
+
+# the rule set also checks reports_to, which the other two do not
+def validate_rule_set(fname):
+    counts = EMPLOYEE_RULES.validate(validate_csv_entries(fname))[0]
+    counts.pop("unknown_managers")
+    return counts
+
+
+def timed(func, fname):
+    start = time.perf_counter()
+    result = func(fname)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-f", "--file", default=csv_file_path)
+    parser.add_argument("-s", "--scale", type=int, default=10)
+    args = parser.parse_args()
+
+    fname, rows = make_data(args.file, args.scale)
+    try:
+        print(f"Benchmarking {rows} employee records ({args.scale}x {args.file})")
+        slow, slow_elapsed = timed(validate_loop, fname)
+        fast, fast_elapsed = timed(validate_columnar, fname)
+        rules, rules_elapsed = timed(validate_rule_set, fname)
+    finally:
+        os.remove(fname)
+
+    print(f"loop:     {slow_elapsed:0.4f} seconds ({rows / slow_elapsed:0.0f} rows/s)")
+    print(f"columnar: {fast_elapsed:0.4f} seconds ({rows / fast_elapsed:0.0f} rows/s)")
+    print(f"rules:    {rules_elapsed:0.4f} seconds ({rows / rules_elapsed:0.0f} rows/s)")
+    print(f"speedup:  {slow_elapsed / fast_elapsed:0.1f}x, same counts: {slow == fast == rules}")
+
+
+if __name__ == "__main__":
+    main()